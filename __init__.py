@@ -5,59 +5,194 @@ from font import createFontBuilder
 from rcjkTools import *
 from flatFont import buildFlatFont
 from varcFont import buildVarcFont
+from staticFont import buildStaticFonts, parseInstance
+from watch import watchFont
+from glyphCache import GlyphCacheBackend
+from memoryBackend import MemoryBackend
+from glyphSelection import parseUnicodes, selectGlyphs, EmptySelectionError
 
 import argparse
 import asyncio
+import os
 import sys
+from functools import partial
 from fontra_rcjk.backend_fs import RCJKBackend
 
 
+async def loadGlyphs(rcjkfont, glyphset=None, status=None, unicodes=None, pattern=None):
+    revCmap = await rcjkfont.getGlyphMap()
+
+    if unicodes is not None or pattern is not None:
+        glyphNames = selectGlyphs(revCmap, glyphset or (), unicodes, pattern)
+        if not glyphNames:
+            raise EmptySelectionError(
+                "No glyphs match the given --unicodes or --glyph-pattern"
+            )
+    else:
+        glyphNames = list(glyphset or revCmap.keys())
+
+    glyphs = {}
+    for glyphname in glyphNames:
+        print("Loading glyph", glyphname)
+        glyph = await rcjkfont.getGlyph(glyphname)
+        if status is not None:
+            if not any(
+                source.customData.get("fontra.development.status", status) == status
+                for source in glyph.sources
+            ):
+                print("Skipping glyph", glyphname)
+                continue
+
+        glyphs[glyphname] = glyph
+
+    return glyphs
+
+
 async def main(args):
     print("Loading glyphs")
 
     parser = argparse.ArgumentParser(description="Build a fontra font")
     parser.add_argument("rcjk_path", type=str, help="Path to the RCJK font")
     parser.add_argument(
-        "glyphs", type=str, nargs="*", help="List of glyphs to build (default: all)"
+        "glyphs",
+        type=str,
+        nargs="*",
+        help="List of glyphs to build (default: all, unless --unicodes or "
+        "--glyph-pattern is given)",
+    )
+    parser.add_argument(
+        "--unicodes",
+        type=parseUnicodes,
+        help="Add the glyphs for these code points to the glyphs to build, given "
+        "as hex values and ranges, e.g. 4E00-4FFF,U+3400 (default: none)",
+    )
+    parser.add_argument(
+        "--glyph-pattern",
+        type=str,
+        help="Add the glyphs with names matching this glob-style pattern to the "
+        "glyphs to build, e.g. 'uni4E*' (default: none)",
     )
     parser.add_argument(
         "--optimize-font-speed",
         action="store_true",
-        help="Optimize the font for speed (default: False)",
+        help="Optimize the font for speed; also lays out varc.ttf such that "
+        "components are stored next to the glyphs using them (default: False)",
     )
     parser.add_argument(
         "--status",
         type=int,
         help="Only build glyphs with the specified status (default: all)",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--iup-tolerance",
+        type=float,
+        help="Drop gvar deltas that can be interpolated within this tolerance, "
+        "in font units (default: keep all deltas)",
+    )
+    parser.add_argument(
+        "--glyph-cache",
+        type=str,
+        help="Path to a cache file of parsed glyphs, to skip parsing unchanged "
+        "glyph files on later runs (default: no cache)",
+    )
+    parser.add_argument(
+        "--instance",
+        type=str,
+        action="append",
+        help="Build a static font at this user-space location instead of the "
+        "variable fonts, written to NAME.ttf; given as NAME:AXIS=VALUE,... "
+        "(can be repeated)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running, and rebuild the fonts whenever the RCJK font changes "
+        "(default: False)",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between checks for changes in watch mode (default: 1)",
+    )
     args = parser.parse_args(args)
 
+    instances = None
+    if args.instance:
+        if args.watch:
+            parser.error("--instance can't be combined with --watch")
+        try:
+            instances = [parseInstance(spec) for spec in args.instance]
+        except ValueError as e:
+            parser.error(str(e))
+
     optimizeSpeed = args.optimize_font_speed or False
 
     rcjk_path = args.rcjk_path
     status = args.status
     glyphset = args.glyphs
+    loadSelected = partial(
+        loadGlyphs,
+        glyphset=glyphset,
+        status=status,
+        unicodes=args.unicodes,
+        pattern=args.glyph_pattern,
+    )
+
+    if args.watch:
+        await watchFont(
+            rcjk_path,
+            loadSelected,
+            optimizeSpeed,
+            args.watch_interval,
+            args.jobs,
+            args.iup_tolerance,
+            args.glyph_cache,
+        )
+        return
 
+    # The builds fetch the glyphs and their components more than once; keep
+    # them in memory so each is only loaded once. GlyphCacheBackend is a
+    # MemoryBackend too.
     rcjkfont = RCJKBackend.fromPath(rcjk_path)
-    revCmap = await rcjkfont.getGlyphMap()
+    if args.glyph_cache:
+        rcjkfont = GlyphCacheBackend(rcjkfont, rcjk_path, args.glyph_cache)
+    else:
+        rcjkfont = MemoryBackend(rcjkfont)
+    try:
+        glyphs = await loadSelected(rcjkfont)
+    except EmptySelectionError as e:
+        parser.error(str(e))
 
-    glyphs = {}
-    for glyphname in revCmap.keys() if not glyphset else glyphset:
-        print("Loading glyph", glyphname)
-        glyph = await rcjkfont.getGlyph(glyphname)
-        glyph_masters = glyphMasters(glyph)
-        if status is not None:
-            if not any(
-                source.customData.get("fontra.development.status", status) == status
-                for source in glyph.sources
-            ):
-                print("Skipping glyph", glyphname)
-                continue
+    if instances:
+        await buildStaticFonts(rcjkfont, glyphs, instances, jobs=args.jobs)
+        if args.glyph_cache:
+            rcjkfont.save()
+        return
 
-        glyphs[glyphname] = glyph
+    await buildVarcFont(
+        rcjkfont,
+        glyphs,
+        optimizeSpeed,
+        jobs=args.jobs,
+        iupTolerance=args.iup_tolerance,
+    )
+    await buildFlatFont(
+        rcjkfont,
+        glyphs,
+        optimizeSpeed,
+        jobs=args.jobs,
+        iupTolerance=args.iup_tolerance,
+    )
 
-    await buildVarcFont(rcjkfont, glyphs, optimizeSpeed)
-    await buildFlatFont(rcjkfont, glyphs, optimizeSpeed)
+    if args.glyph_cache:
+        rcjkfont.save()
 
 
 if __name__ == "__main__":
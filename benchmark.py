@@ -0,0 +1,195 @@
+# Compare the runtime cost of varc.ttf against flat.ttf.
+#
+# Usage: python benchmark.py varc.ttf flat.ttf [--glyphs N] [--locations N]
+#
+# Draws a random sample of glyphs at random design-space locations through
+# fontTools' glyph sets, and reports load times and per-table sizes.
+
+from fontTools.ttLib import TTFont
+from fontTools.pens.basePen import NullPen
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+
+def loadFont(path):
+    t0 = time.perf_counter()
+    font = TTFont(path)
+    font.ensureDecompiled()
+    t1 = time.perf_counter()
+    return font, t1 - t0
+
+
+def tableSizes(font):
+    return {tag: entry.length for tag, entry in font.reader.tables.items()}
+
+
+def publicAxes(font):
+    if "fvar" not in font:
+        return []
+    # Skip the hidden per-glyph axes of varc.ttf
+    return [axis for axis in font["fvar"].axes if not axis.flags & 0x0001]
+
+
+def sampleGlyphs(fonts, count, rng):
+    # Only glyphs that are encoded, and hence present, in all fonts
+    common = None
+    for font in fonts:
+        names = set(font.getBestCmap().values())
+        common = names if common is None else common & names
+    common = sorted(common)
+    if count and count < len(common):
+        common = sorted(rng.sample(common, count))
+    return common
+
+
+def sampleLocations(axes, count, rng):
+    locations = [{}]  # Default master
+    for i in range(count - 1):
+        locations.append(
+            {axis.axisTag: rng.uniform(axis.minValue, axis.maxValue) for axis in axes}
+        )
+    return locations
+
+
+def timeDrawing(font, glyphNames, locations):
+    pen = NullPen()
+    t0 = time.perf_counter()
+    for location in locations:
+        glyphset = font.getGlyphSet(location=location)
+        for glyphName in glyphNames:
+            glyphset[glyphName].draw(pen)
+    t1 = time.perf_counter()
+    return t1 - t0
+
+
+def benchmarkFont(path, glyphNames, locations, repeat):
+    loadTimes = []
+    drawTimes = []
+    for i in range(repeat):
+        font, loadTime = loadFont(path)
+        loadTimes.append(loadTime)
+        drawTimes.append(timeDrawing(font, glyphNames, locations))
+
+    return {
+        "path": path,
+        "fileSize": os.path.getsize(path),
+        "loadTime": min(loadTimes),
+        "drawTime": min(drawTimes),
+        "drawTimeMedian": statistics.median(drawTimes),
+        "drawTimePerGlyph": min(drawTimes) / max(len(glyphNames) * len(locations), 1),
+        "tables": tableSizes(font),
+    }
+
+
+def formatRatio(a, b):
+    return "%.2fx" % (a / b) if b else "-"
+
+
+def printReport(varc, flat, numGlyphs, numLocations, file=sys.stdout):
+    print(
+        "Sampled %d glyphs at %d locations" % (numGlyphs, numLocations),
+        file=file,
+    )
+    print(file=file)
+    print("%-24s %14s %14s %8s" % ("", "varc", "flat", "ratio"), file=file)
+
+    rows = [
+        ("file size (bytes)", "fileSize", "%d"),
+        ("load time (ms)", "loadTime", "%.3f"),
+        ("draw time (ms)", "drawTime", "%.3f"),
+        ("draw time median (ms)", "drawTimeMedian", "%.3f"),
+        ("draw per glyph (us)", "drawTimePerGlyph", "%.3f"),
+    ]
+    scales = {
+        "loadTime": 1e3,
+        "drawTime": 1e3,
+        "drawTimeMedian": 1e3,
+        "drawTimePerGlyph": 1e6,
+    }
+    for label, key, fmt in rows:
+        scale = scales.get(key, 1)
+        v, f = varc[key] * scale, flat[key] * scale
+        print(
+            "%-24s %14s %14s %8s" % (label, fmt % v, fmt % f, formatRatio(v, f)),
+            file=file,
+        )
+
+    print(file=file)
+    print(
+        "%-24s %14s %14s %8s" % ("table sizes (bytes)", "varc", "flat", "ratio"),
+        file=file,
+    )
+    tags = sorted(set(varc["tables"]) | set(flat["tables"]))
+    for tag in tags:
+        v = varc["tables"].get(tag, 0)
+        f = flat["tables"].get(tag, 0)
+        print("  %-22s %14d %14d %8s" % (tag, v, f, formatRatio(v, f)), file=file)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Compare runtime cost of varc.ttf and flat.ttf"
+    )
+    parser.add_argument("varc_path", type=str, help="Path to varc.ttf")
+    parser.add_argument("flat_path", type=str, help="Path to flat.ttf")
+    parser.add_argument(
+        "--glyphs",
+        type=int,
+        default=1000,
+        help="Number of glyphs to sample, 0 for all (default: 1000)",
+    )
+    parser.add_argument(
+        "--locations",
+        type=int,
+        default=10,
+        help="Number of locations to sample, including default (default: 10)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of timing runs; the fastest one is reported (default: 3)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument(
+        "--json",
+        type=str,
+        help="Also write the report as JSON to this path",
+    )
+    args = parser.parse_args(args)
+
+    rng = random.Random(args.seed)
+
+    varcFont = TTFont(args.varc_path)
+    flatFont = TTFont(args.flat_path)
+    glyphNames = sampleGlyphs([varcFont, flatFont], args.glyphs, rng)
+    # The flat font only has the public axes
+    locations = sampleLocations(publicAxes(flatFont), max(args.locations, 1), rng)
+
+    varc = benchmarkFont(args.varc_path, glyphNames, locations, args.repeat)
+    flat = benchmarkFont(args.flat_path, glyphNames, locations, args.repeat)
+
+    printReport(varc, flat, len(glyphNames), len(locations))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "glyphs": glyphNames,
+                    "locations": locations,
+                    "varc": varc,
+                    "flat": flat,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
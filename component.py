@@ -1,6 +1,5 @@
 from fontTools.misc.roundTools import otRound
 from fontTools.misc.fixedTools import floatToFixed as fl2fi
-from fontTools.varLib.models import normalizeLocation
 from fontTools.ttLib.tables.otTables import (
     VarComponent,
     VarComponentFlags,
@@ -8,6 +7,7 @@ from fontTools.ttLib.tables.otTables import (
 )
 from fontTools.misc.transform import DecomposedTransform
 from rcjkTools import *
+from normalizer import cachedAxesNormalizer
 import struct
 
 
@@ -78,20 +78,24 @@ def _usesPublicAxes(componentGlyph, publicAxes, glyphs):
     return False
 
 
-def analyzeComponents(glyph_masters, glyphs, glyphAxes, publicAxes):
+def analyzeComponents(glyph_masters, glyphs, glyphAxes, publicAxes, axesMaps, axesMap):
+    # axesMap is the glyph's own axes map, axesMaps those of all glyphs.
     layer = next(iter(glyph_masters.values()))
     defaultComponents = layer.glyph.components
     defaultLocations = []
-    allComponentAxes = []
+    allNormalizedLocations = []
     allUsesPublicAxes = []
-    for component in defaultComponents:
-        loc = component.location
+    for i, component in enumerate(defaultComponents):
         componentAxes = {
             axis.name: (axis.minValue, axis.defaultValue, axis.maxValue)
             for axis in glyphs[component.name].axes
         }
-        allComponentAxes.append(componentAxes)
-        loc = normalizeLocation(loc, componentAxes)
+        # The component's location in all masters, normalized at once
+        normalizedLocations = cachedAxesNormalizer(componentAxes).normalizeLocations(
+            layer.glyph.components[i].location for layer in glyph_masters.values()
+        )
+        allNormalizedLocations.append(normalizedLocations)
+        loc = normalizedLocations[0]
         defaultLocations.append(loc)
         usesPublicAxes = any(axis in publicAxes for axis in loc) or _usesPublicAxes(
             glyphs[component.name], publicAxes, glyphs
@@ -109,11 +113,17 @@ def analyzeComponents(glyph_masters, glyphs, glyphAxes, publicAxes):
     for ca in cas:
         ca.coordinates = list(sorted(ca.coordinates))
 
-    for masterLocationTuple, layer in glyph_masters.items():
+    for masterIndex, (masterLocationTuple, layer) in enumerate(glyph_masters.items()):
         masterLocation = dictifyLocation(masterLocationTuple)
         for axis in glyphAxes:
             if axis not in masterLocation:
                 masterLocation[axis] = 0
+        # Components inherit the glyph's location by axis tag, not by name
+        masterLocation = {
+            axesMap[name]: value
+            for name, value in masterLocation.items()
+            if name in axesMap
+        }
 
         for i, component in enumerate(layer.glyph.components):
             assert component.name == defaultComponents[i].name, (
@@ -130,9 +140,8 @@ def analyzeComponents(glyph_masters, glyphs, glyphAxes, publicAxes):
                 ca.transformHave.have_rotation = True
             if fl2fi(t.scaleX, 10) != 1 << 10:
                 ca.transformHave.have_scaleX = True
-            if fl2fi(t.scaleY, 10) != 1 << 10 and fl2fi(t.scaleY, 10) != fl2fi(
-                t.scaleX, 10
-            ):
+            # Without HAVE_SCALE_Y, scaleY is taken to be scaleX
+            if fl2fi(t.scaleY, 10) != fl2fi(t.scaleX, 10):
                 ca.transformHave.have_scaleY = True
             if fl2fi(t.skewX / 180.0, 12):
                 ca.transformHave.have_skewX = True
@@ -143,15 +152,16 @@ def analyzeComponents(glyph_masters, glyphs, glyphAxes, publicAxes):
             if otRound(t.tCenterY):
                 ca.transformHave.have_tcenterY = True
 
-            loc = component.location
-            loc = normalizeLocation(loc, allComponentAxes[i])
+            loc = allNormalizedLocations[i][masterIndex]
+            componentAxesMap = axesMaps[component.name]
             for name in ca.coordinates:
                 c = loc.get(name, 0)
 
                 if allUsesPublicAxes[i] or c:
                     ca.coordinateHaveReset.add(name)
 
-                if not (name in masterLocation and c == masterLocation[name]):
+                tag = componentAxesMap.get(name)
+                if not (tag in masterLocation and c == masterLocation[tag]):
                     ca.coordinateHaveOverlay.add(name)
 
     for ca in cas:
@@ -162,11 +172,12 @@ def analyzeComponents(glyph_masters, glyphs, glyphAxes, publicAxes):
             ca.coordinateHaveReset if ca.coordinatesReset else ca.coordinateHaveOverlay
         )
 
-    for layer in list(glyph_masters.values())[1:]:
+    for masterIndex, layer in enumerate(glyph_masters.values()):
+        if not masterIndex:
+            continue
         for i, component in enumerate(layer.glyph.components):
             ca = cas[i]
-            loc = component.location
-            loc = normalizeLocation(loc, allComponentAxes[i])
+            loc = allNormalizedLocations[i][masterIndex]
             for name in ca.coordinates:
                 # XXX Is this logic correct for coordinatesHaveReset?
                 if name in ca.coordinateHave and loc.get(name, 0) != defaultLocations[
@@ -178,27 +189,20 @@ def analyzeComponents(glyph_masters, glyphs, glyphAxes, publicAxes):
 
 
 def getComponentMasters(
-    rcjkfont, component, componentGlyph, componentAnalysis, fvarTags, publicAxes
+    rcjkfont, component, componentGlyph, componentAnalysis, fvarTags, axesMap
 ):
+    # axesMap is the component glyph's axes map, of axis name to fvar tag
     ca = componentAnalysis
 
     componentAxes = {
         axis.name: (axis.minValue, axis.defaultValue, axis.maxValue)
         for axis in componentGlyph.axes
     }
-    axesMap = {}
-    i = 0
-    for name in sorted(componentAxes.keys()):
-        if name in publicAxes:
-            axesMap[name] = name
-        elif name in fvarTags:
-            axesMap[name] = name
-        else:
-            axesMap[name] = "%04d" % i
-            i += 1
+    # Only the component glyph's own axes are addressable
+    axesMap = {name: axesMap[name] for name in componentAxes.keys() if name in axesMap}
 
     coords = component.location
-    coords = normalizeLocation(coords, componentAxes)
+    coords = cachedAxesNormalizer(componentAxes).normalizeLocation(coords)
 
     axisIndexMasters, axisValueMasters, transformMasters = [], [], []
 
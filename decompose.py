@@ -1,134 +1,287 @@
-from font import mapTuple
 from transform import composeTransform, Identity
 from mathRecording import MathRecording
 from rcjkTools import *
+from normalizer import AxesNormalizer
 
 from fontTools.pens.recordingPen import RecordingPointPen
 from fontTools.pens.transformPen import TransformPointPen
-from fontTools.varLib.models import normalizeLocation, VariationModel
+from fontTools.varLib.models import VariationModel
 from fontTools.misc.vector import Vector
+from collections import OrderedDict
+import asyncio
 
 
-async def decomposeGlyph(glyph, rcjkfont, location=(), trans=Identity):
-    value = []
-    axes = {
-        axis.name: mapTuple(
-            (axis.minValue, axis.defaultValue, axis.maxValue), axis.mapping
-        )
-        for axis in (await rcjkfont.getAxes()).axes
-    }
-    axes.update(
-        {
-            axis.name: (axis.minValue, axis.defaultValue, axis.maxValue)
-            for axis in glyph.axes
-        }
-    )
+def glyphModel(glyph, fontAxes):
+    normalizer = AxesNormalizer.fromFontAxes(fontAxes, glyph.axes)
 
     glyph_masters = glyphMasters(glyph)
 
-    masterLocs = list(dictifyLocation(l) for l in glyph_masters.keys())
-    masterLocs = [normalizeLocation(m, axes, validate=True) for m in masterLocs]
+    masterLocs = normalizer.normalizeLocations(
+        (dictifyLocation(l) for l in glyph_masters.keys()), validate=True
+    )
+
+    model = VariationModel(masterLocs, normalizer.axisNames)
+
+    return normalizer, glyph_masters, model
+
+
+async def getGlyphModel(glyph, rcjkfont):
+    return glyphModel(glyph, (await rcjkfont.getAxes()).axes)
+
+
+def _inheritedLocation(glyph, fontAxes, location):
+    # Components follow the font axes of their parent, unless the parent
+    # has a glyph axis of the same name.
+    glyphAxes = {axis.name for axis in glyph.axes}
+    return {
+        axis.name: location[axis.name]
+        for axis in fontAxes
+        if axis.name in location and axis.name not in glyphAxes
+    }
+
 
-    model = VariationModel(masterLocs, list(axes.keys()))
+async def inheritedLocation(glyph, rcjkfont, location):
+    return _inheritedLocation(glyph, (await rcjkfont.getAxes()).axes, location)
 
-    # Interpolate outline
 
-    masterShapes = [
-        await decomposeLayer(layer, rcjkfont, trans, shallow=True)
-        for layer in glyph_masters.values()
-    ]
+def transformRecording(value, trans):
+    out = []
+    for v in value:
+        if v[0] != "addPoint":
+            out.append(v)
+            continue
+        op, (pt, segmentType, smooth, name), kwargs = v
+        pt = trans.transformPoint(pt)
+        out.append((op, (pt, segmentType, smooth, name), kwargs))
+    return out
 
-    loc = normalizeLocation(location, axes)  # , validate=True)
-    shape = model.interpolateFromMasters(loc, masterShapes)
 
-    value.extend(shape.value)
+class DecompositionCache:
+    """A cache of decomposed outlines for Decomposer that keeps the maxSize
+    most recently used ones, and counts hits and misses."""
 
-    # Interpolate components
+    def __init__(self, maxSize=4096):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+
+class Decomposer:
+    """Decompose glyphs as plain synchronous code, over an in-memory table
+    of glyphs holding their whole component closure. Glyph models are
+    built once per glyph; given a cache, a dict or DecompositionCache,
+    decomposed outlines are kept per glyph and location as well."""
+
+    def __init__(self, glyphs, fontAxes, cache=None):
+        self.glyphs = glyphs
+        self.fontAxes = fontAxes
+        self.cache = cache
+        self._models = {}
+        self._usedAxes = {}
+
+    @classmethod
+    async def fromBackend(cls, rcjkfont, glyphs, cache=None):
+        """Fetch the component closure of glyphs from rcjkfont, once."""
+        glyphs = {glyph.name: glyph for glyph in glyphs}
+        await closureGlyphs(rcjkfont, glyphs)
+        return cls(glyphs, (await rcjkfont.getAxes()).axes, cache)
+
+    def glyphModel(self, glyph):
+        model = self._models.get(glyph.name)
+        if model is None:
+            model = self._models[glyph.name] = glyphModel(glyph, self.fontAxes)
+        return model
+
+    def inheritedLocation(self, glyph, location):
+        return _inheritedLocation(glyph, self.fontAxes, location)
+
+    def usedAxes(self, glyph):
+        """The names of the axes the decomposition of glyph varies on: the
+        axes of its variation regions, and the font axes its components
+        inherit and vary on."""
+        axes = self._usedAxes.get(glyph.name)
+        if axes is None:
+            normalizer, glyph_masters, model = self.glyphModel(glyph)
+            axes = set()
+            for support in model.supports:
+                axes.update(support)
+            glyphAxes = {axis.name for axis in glyph.axes}
+            inheritable = {
+                axis.name for axis in self.fontAxes if axis.name not in glyphAxes
+            }
+            componentNames = {
+                component.name
+                for layer in glyph_masters.values()
+                for component in layer.glyph.components
+            }
+            for name in componentNames:
+                axes.update(self.usedAxes(self.glyphs[name]) & inheritable)
+            axes = self._usedAxes[glyph.name] = frozenset(axes)
+        return axes
+
+    def decomposeGlyph(self, glyph, location=(), trans=Identity):
+        cache = self.cache
+        if cache is not None:
+            # Cache the untransformed outline; interpolation commutes with
+            # affine transforms, so transform afterwards. Key on the axes the
+            # glyph varies on only, so that locations differing in inherited
+            # axes it doesn't use, as between instances, share an entry.
+            usedAxes = self.usedAxes(glyph)
+            key = (
+                glyph.name,
+                tuplifyLocation(
+                    {k: v for k, v in dict(location).items() if k in usedAxes}
+                ),
+            )
+            value = cache.get(key)
+            if value is None:
+                value = cache[key] = self._decomposeGlyph(
+                    glyph, location, Identity
+                ).value
+            if trans is not Identity:
+                value = transformRecording(value, trans)
+            return MathRecording(value)
 
-    numComps = len(next(iter(glyph_masters.values())).glyph.components)
-    for compIndex in range(numComps):
-        compTransforms = []
-        compLocations = []
-        name = None
+        return self._decomposeGlyph(glyph, location, trans)
+
+    def _decomposeGlyph(self, glyph, location, trans):
+        value = []
+        normalizer, glyph_masters, model = self.glyphModel(glyph)
+
+        # Interpolate outline
+
+        # Masters sharing a layer share its outline
+        layerShapes = {}
+        masterShapes = []
         for layer in glyph_masters.values():
-            compName = layer.glyph.components[compIndex].name
-            if name is not None:
-                assert name == compName
-            name = compName
-            compTransforms.append(layer.glyph.components[compIndex].transformation)
-            compLocations.append(layer.glyph.components[compIndex].location)
-
-        locKeys = set()
-        for locations in compLocations:
-            locKeys.update(locations.keys())
-        locKeys = sorted(locKeys)
-        locationVectors = []
-        for locations in compLocations:
-            locationVectors.append(Vector(locations.get(k, 0) for k in locKeys))
-        transformVectors = []
-        for t in compTransforms:
-            transformVectors.append(
-                Vector(
-                    (
-                        t.translateX,
-                        t.translateY,
-                        t.rotation,
-                        t.scaleX,
-                        t.scaleY,
-                        t.skewX,
-                        t.skewY,
-                        t.tCenterX,
-                        t.tCenterY,
+            shape = layerShapes.get(id(layer))
+            if shape is None:
+                shape = layerShapes[id(layer)] = self.decomposeLayer(
+                    layer, trans, shallow=True
+                )
+            masterShapes.append(shape)
+
+        loc = normalizer.normalizeLocation(location)  # , validate=True)
+        shape = model.interpolateFromMasters(loc, masterShapes)
+
+        value.extend(shape.value)
+
+        # Interpolate components
+
+        inherited = self.inheritedLocation(glyph, location)
+        numComps = len(next(iter(glyph_masters.values())).glyph.components)
+        for compIndex in range(numComps):
+            compTransforms = []
+            compLocations = []
+            name = None
+            for layer in glyph_masters.values():
+                compName = layer.glyph.components[compIndex].name
+                if name is not None:
+                    assert name == compName
+                name = compName
+                compTransforms.append(layer.glyph.components[compIndex].transformation)
+                compLocations.append(layer.glyph.components[compIndex].location)
+
+            locKeys = set()
+            for locations in compLocations:
+                locKeys.update(locations.keys())
+            locKeys = sorted(locKeys)
+            locationVectors = []
+            for locations in compLocations:
+                locationVectors.append(Vector(locations.get(k, 0) for k in locKeys))
+            transformVectors = []
+            for t in compTransforms:
+                transformVectors.append(
+                    Vector(
+                        (
+                            t.translateX,
+                            t.translateY,
+                            t.rotation,
+                            t.scaleX,
+                            t.scaleY,
+                            t.skewX,
+                            t.skewY,
+                            t.tCenterX,
+                            t.tCenterY,
+                        )
                     )
                 )
-            )
 
-        locationVector = model.interpolateFromMasters(loc, locationVectors)
-        transformVector = model.interpolateFromMasters(loc, transformVectors)
+            locationVector = model.interpolateFromMasters(loc, locationVectors)
+            transformVector = model.interpolateFromMasters(loc, transformVectors)
 
-        location = {k: v for k, v in zip(locKeys, locationVector)}
-        transform = composeTransform(*transformVector)
-        composedTrans = trans.transform(transform)
+            compLocation = dict(inherited)
+            compLocation.update(zip(locKeys, locationVector))
+            transform = composeTransform(*transformVector)
+            composedTrans = trans.transform(transform)
 
-        componentGlyph = await rcjkfont.getGlyph(name)
-        shape = await decomposeGlyph(componentGlyph, rcjkfont, location, composedTrans)
-        value.extend(shape.value)
+            shape = self.decomposeGlyph(self.glyphs[name], compLocation, composedTrans)
+            value.extend(shape.value)
+
+        return MathRecording(value)
+
+    def decomposeLayer(self, layer, trans=Identity, shallow=False, location=()):
+        # location is the font-axes location passed on to the components,
+        # as returned by inheritedLocation().
+        pen = RecordingPointPen()
+        tpen = TransformPointPen(pen, trans)
+        layer.glyph.path.drawPoints(tpen)
+        value = pen.value
+
+        if shallow:
+            return MathRecording(value)
 
-    return MathRecording(value)
+        for component in layer.glyph.components:
+            t = component.transformation
+            componentTrans = composeTransform(
+                t.translateX,
+                t.translateY,
+                t.rotation,
+                t.scaleX,
+                t.scaleY,
+                t.skewX,
+                t.skewY,
+                t.tCenterX,
+                t.tCenterY,
+            )
+            composedTrans = trans.transform(componentTrans)
 
+            compLocation = dict(location)
+            compLocation.update(component.location)
 
-async def decomposeLayer(layer, rcjkfont, trans=Identity, shallow=False):
-    pen = RecordingPointPen()
-    tpen = TransformPointPen(pen, trans)
-    layer.glyph.path.drawPoints(tpen)
-    value = pen.value
+            value.extend(
+                self.decomposeGlyph(
+                    self.glyphs[component.name], compLocation, composedTrans
+                ).value
+            )
 
-    if shallow:
         return MathRecording(value)
 
-    for component in layer.glyph.components:
-        t = component.transformation
-        componentTrans = composeTransform(
-            t.translateX,
-            t.translateY,
-            t.rotation,
-            t.scaleX,
-            t.scaleY,
-            t.skewX,
-            t.skewY,
-            t.tCenterX,
-            t.tCenterY,
-        )
-        composedTrans = trans.transform(componentTrans)
-
-        componentGlyph = await rcjkfont.getGlyph(component.name)
-
-        value.extend(
-            (
-                await decomposeGlyph(
-                    componentGlyph, rcjkfont, component.location, composedTrans
-                )
-            ).value
-        )
 
-    return MathRecording(value)
+async def decomposeGlyph(glyph, rcjkfont, location=(), trans=Identity, cache=None):
+    decomposer = await Decomposer.fromBackend(rcjkfont, [glyph], cache)
+    return decomposer.decomposeGlyph(glyph, location, trans)
+
+
+async def decomposeLayer(layer, rcjkfont, trans=Identity, shallow=False, location=()):
+    components = []
+    if not shallow:
+        names = list(dict.fromkeys(c.name for c in layer.glyph.components))
+        components = await asyncio.gather(*(rcjkfont.getGlyph(n) for n in names))
+    decomposer = await Decomposer.fromBackend(rcjkfont, components)
+    return decomposer.decomposeLayer(layer, trans, shallow, location)
@@ -1,8 +1,7 @@
-from font import createFontBuilder, fixLsb, mapTuple
-from decompose import decomposeLayer
+from font import createFontBuilder, fixLsb
+from decompose import Decomposer
 from rcjkTools import *
 
-from fontTools.varLib.models import normalizeLocation, VariationModel
 from fontTools.pens.recordingPen import RecordingPen, RecordingPointPen
 from fontTools.pens.pointPen import PointToSegmentPen
 from fontTools.pens.ttGlyphPen import TTGlyphPen
@@ -10,98 +9,267 @@ from fontTools.pens.cu2quPen import Cu2QuMultiPen
 from fontTools.pens.boundsPen import ControlBoundsPen
 from fontTools.ttLib.tables._g_l_y_f import Glyph, GlyphCoordinates
 from fontTools.ttLib.tables.TupleVariation import TupleVariation
+from parallelCompile import precompileGlyfGvar
 from functools import partial
+from collections import Counter
+
+# What replayCommandsThroughCu2QuMultiPen() did, for printCu2QuStats().
+# Worker processes send theirs back to be added in.
+cu2quStats = Counter()
+# The masters buildFlatGlyph() reused another master's outline for, for
+# printMasterStats(). Worker processes send these back as well.
+masterStats = Counter()
+# Compiled gvar variation sizes before and after IUP optimization, for
+# printIupStats().
+iupStats = Counter()
+
+
+def clearStats():
+    for stats in (cu2quStats, masterStats, iupStats):
+        stats.clear()
+
+
+def collectStats():
+    """The stats of this process, to send back from a worker process."""
+    return dict(cu2quStats), dict(masterStats), dict(iupStats)
+
+
+def addStats(collected):
+    for stats, values in zip((cu2quStats, masterStats, iupStats), collected):
+        stats.update(values)
 
 
 def replayCommandsThroughCu2QuMultiPen(commands, cu2quPen):
     commands = list(commands)
     firstCommand = commands[0]
     assert all(len(command) == len(firstCommand) for command in commands)
+    start = 0
+    for end, (opName, opArgs) in enumerate(firstCommand, 1):
+        if opName in ("closePath", "endPath"):
+            _replayContour([command[start:end] for command in commands], cu2quPen)
+            start = end
+    if start < len(firstCommand):
+        _replayOps([command[start:] for command in commands], cu2quPen)
+
+
+def _replayContour(contours, cu2quPen):
+    cu2quStats["contours"] += 1
+    if any(op[0] == "curveTo" for contour in contours for op in contour):
+        _replayOps(contours, cu2quPen)
+        return
+
+    # Lines and quadratic curves only, in all masters: Cu2QuMultiPen would
+    # pass them on as they are, so draw them into its pens directly.
+    cu2quStats["skippedContours"] += 1
+    for ops in zip(*contours):
+        opName = ops[0][0]
+        assert all(op[0] == opName for op in ops)
+        if opName == "qCurveTo" and len(ops[0][1]) == 1:
+            opName = "lineTo"  # Like Cu2QuMultiPen
+        for (_, opArgs), pen in zip(ops, cu2quPen.pens):
+            getattr(pen, opName)(*opArgs)
+
+
+def _replayOps(commands, cu2quPen):
     for ops in zip(*commands):
         opNames = [op[0] for op in ops]
         opArgs = [op[1] for op in ops]
         opName = opNames[0]
         assert all(name == opName for name in opNames)
+        if opName == "curveTo":
+            cu2quStats["curves"] += 1
         if len(opArgs[0]):
             getattr(cu2quPen, opName)(opArgs)
         else:
             getattr(cu2quPen, opName)()
 
 
-async def buildFlatGlyph(rcjkfont, glyph, axesNameToTag=None):
-    axes = {
-        axis.name: mapTuple(
-            (axis.minValue, axis.defaultValue, axis.maxValue), axis.mapping
+def printCu2QuStats(stats=cu2quStats):
+    contours = stats["contours"]
+    skipped = stats["skippedContours"]
+    print(
+        "cu2qu: %d of %d contours had no cubic curves and were skipped (%.1f%%); "
+        "converted %d curves"
+        % (
+            skipped,
+            contours,
+            100 * skipped / contours if contours else 0,
+            stats["curves"],
         )
-        for axis in (await rcjkfont.getAxes()).axes
-    }
-    axes.update(
-        {
-            axis.name: (axis.minValue, axis.defaultValue, axis.maxValue)
-            for axis in glyph.axes
-        }
     )
 
-    glyph_masters = glyphMasters(glyph)
 
-    shapes = {}
-    for loc, layer in glyph_masters.items():
-        loc = dictifyLocation(loc)
-        loc = normalizeLocation(loc, axes, validate=True)
-        loc = {k: v for k, v in loc.items() if v != 0}
+def printMasterStats(stats=masterStats):
+    masters = stats["masters"]
+    shared = stats["sharedLayers"]
+    identical = stats["identicalLayers"]
+    print(
+        "Master deduplication: reused the outline of %d of %d masters (%.1f%%); "
+        "%d shared a layer, %d had an identical layer"
+        % (
+            shared + identical,
+            masters,
+            100 * (shared + identical) / masters if masters else 0,
+            shared,
+            identical,
+        )
+    )
+
+
+def printIupStats(fbVariations, stats=iupStats):
+    dropped = total = 0
+    for variations in fbVariations.values():
+        for tv in variations:
+            total += len(tv.coordinates)
+            dropped += tv.coordinates.count(None)
+    before = stats["bytesBefore"]
+    after = stats["bytesAfter"]
+    print(
+        "IUP optimization: gvar variation data %d bytes, down from %d (%.1f%% "
+        "smaller); dropped %d of %d point deltas (%.1f%%)"
+        % (
+            after,
+            before,
+            100 * (before - after) / before if before else 0,
+            dropped,
+            total,
+            100 * dropped / total if total else 0,
+        )
+    )
+
+
+def _compiledSize(tv):
+    tupleData, auxData = tv.compile(sorted(tv.axes))
+    return len(tupleData) + len(auxData)
+
+
+def buildAdvanceVariations(model, advances):
+    """The gvar variations of a glyph without outline: only the phantom
+    point carrying the advance width varies. Deltas come from model, one
+    advance per master; the masters' locations must be in axis tags."""
+    masterCoords = [
+        GlyphCoordinates([(0, 0), (advance, 0), (0, 0), (0, 0)]) for advance in advances
+    ]
+    deltas, supports = model.getDeltasAndSupports(
+        masterCoords, round=partial(GlyphCoordinates.__round__, round=round)
+    )
+    return [
+        TupleVariation(support, delta)
+        for delta, support in zip(deltas[1:], supports[1:])
+        if any(delta[1])
+    ]
+
+
+async def buildFlatGlyph(
+    rcjkfont,
+    glyph,
+    axesNameToTag=None,
+    iupTolerance=None,
+    shallow=False,
+    decomposer=None,
+):
+    # With shallow, only the glyph's own outline is built, not its components.
+    # A decomposer shared between glyphs must hold the glyph's closure.
+    if decomposer is None:
+        decomposer = await Decomposer.fromBackend(rcjkfont, [] if shallow else [glyph])
+    normalizer, glyph_masters, model = decomposer.glyphModel(glyph)
+
+    masterLocs = [dictifyLocation(l) for l in glyph_masters.keys()]
+    normalizedLocs = normalizer.normalizeLocations(masterLocs, validate=True)
+
+    # Masters sharing a layer, or with identical layers, are decomposed and
+    # converted once; masterIndices maps each master to its unique shape.
+    shapes = []
+    shapeIndices = {}
+    shapeLayers = []
+    masterIndices = []
+    normalizedLocTuples = []
+    for loc, normalizedLoc, layer in zip(
+        masterLocs, normalizedLocs, glyph_masters.values()
+    ):
+        inherited = decomposer.inheritedLocation(glyph, loc)
+        loc = {k: v for k, v in normalizedLoc.items() if v != 0}
         loc = tuplifyLocation(loc)
+        assert loc not in normalizedLocTuples, loc
+        normalizedLocTuples.append(loc)
+
+        drawsComponents = not shallow and layer.glyph.components
+        key = (
+            layerGeometryKey(layer, components=not shallow),
+            tuplifyLocation(inherited) if drawsComponents else (),
+        )
+        masterStats["masters"] += 1
+        index = shapeIndices.get(key)
+        if index is not None:
+            sharedLayer = shapeLayers[index] is layer
+            masterStats["sharedLayers" if sharedLayer else "identicalLayers"] += 1
+            masterIndices.append(index)
+            continue
 
         rspen = RecordingPen()
         pspen = PointToSegmentPen(rspen, outputImpliedClosingLine=True)
         rppen = RecordingPointPen()
-        rppen.value = (await decomposeLayer(layer, rcjkfont)).value
+        rppen.value = decomposer.decomposeLayer(
+            layer, shallow=shallow, location=inherited
+        ).value
         rppen.replay(pspen)
 
-        assert loc not in shapes, loc
-        shapes[loc] = rspen.value
+        index = shapeIndices[key] = len(shapes)
+        shapes.append(rspen.value)
+        shapeLayers.append(layer)
+        masterIndices.append(index)
 
-    pens = [TTGlyphPen() for i in range(len(glyph_masters))]
+    pens = [TTGlyphPen() for i in range(len(shapes))]
     cu2quPen = Cu2QuMultiPen(pens, 1)
-    # Pass all shapes through Cu2QuMultiPen
-    assert len(shapes) == len(pens)
-    replayCommandsThroughCu2QuMultiPen(shapes.values(), cu2quPen)
+    # Pass all unique shapes through Cu2QuMultiPen; duplicate masters don't
+    # change the compatible conversion.
+    replayCommandsThroughCu2QuMultiPen(shapes, cu2quPen)
     pens = [pen.glyph() for pen in pens]
+    pens = [pens[index] for index in masterIndices]
 
     # default master
-    assert () == list(shapes.keys())[0]
+    assert () == normalizedLocTuples[0]
     fbGlyph = pens[0]
 
     # variations
 
     fbVariations = []
 
-    masterCoords = [pen.coordinates for pen in pens]
-
-    masterLocs = list(dictifyLocation(l) for l in glyph_masters.keys())
-    masterLocs = [normalizeLocation(m, axes, validate=True) for m in masterLocs]
-
-    model = VariationModel(masterLocs, list(axes.keys()))
+    masterCoords = []
+    for pen, layer in zip(pens, glyph_masters.values()):
+        coords = GlyphCoordinates(pen.coordinates)
+        # Phantom points; only the advance width varies
+        coords.extend([(0, 0), (layer.glyph.xAdvance, 0), (0, 0), (0, 0)])
+        masterCoords.append(coords)
 
     deltas, supports = model.getDeltasAndSupports(
         masterCoords, round=partial(GlyphCoordinates.__round__, round=round)
     )
 
-    fbGlyph.coordinates = deltas[0]
+    origCoords = deltas[0]
+    fbGlyph.coordinates = GlyphCoordinates(origCoords[:-4])
     for delta, support in zip(deltas[1:], supports[1:]):
-        delta.extend([(0, 0), (0, 0), (0, 0), (0, 0)])  # TODO Phantom points
         if axesNameToTag is not None:
             support = {
                 axesNameToTag[k] if k in axesNameToTag else k: v
                 for k, v in support.items()
             }
         tv = TupleVariation(support, delta)
+        if iupTolerance is not None:
+            # Drop deltas that can be interpolated, if that's smaller
+            iupStats["bytesBefore"] += _compiledSize(tv)
+            tv.optimize(origCoords, fbGlyph.endPtsOfContours, tolerance=iupTolerance)
+            iupStats["bytesAfter"] += _compiledSize(tv)
         fbVariations.append(tv)
 
     return fbGlyph, fbVariations
 
 
-async def buildFlatFont(rcjkfont, glyphs, optimizeSpeed=False):
+async def buildFlatFont(
+    rcjkfont, glyphs, optimizeSpeed=False, cache=None, jobs=1, iupTolerance=None
+):
     print("Building flat.ttf")
+    clearStats()
 
     revCmap = await rcjkfont.getGlyphMap()
     charGlyphs = {g: v for g, v in glyphs.items() if revCmap[g]}
@@ -111,13 +279,29 @@ async def buildFlatFont(rcjkfont, glyphs, optimizeSpeed=False):
     fbGlyphs = {".notdef": Glyph()}
     fbVariations = {}
     glyphRecordings = {}
+    # Fetches the component closure once, and builds each glyph model once
+    decomposer = await Decomposer.fromBackend(
+        rcjkfont,
+        [
+            glyph
+            for glyph in charGlyphs.values()
+            if cache is None or glyph.name not in cache
+        ],
+    )
     for glyph in charGlyphs.values():
+        if cache is not None and glyph.name in cache:
+            fbGlyphs[glyph.name], fbVariations[glyph.name] = cache[glyph.name]
+            continue
         print("Processing flat glyph", glyph.name)
         fbGlyphs[glyph.name], fbVariations[glyph.name] = await buildFlatGlyph(
             rcjkfont,
             glyph,
             {axis.name: axis.tag for axis in (await rcjkfont.getAxes()).axes},
+            iupTolerance,
+            decomposer=decomposer,
         )
+        if cache is not None:
+            cache[glyph.name] = fbGlyphs[glyph.name], fbVariations[glyph.name]
 
     fvarAxes = []
     for axis in (await rcjkfont.getAxes()).axes:
@@ -131,10 +315,18 @@ async def buildFlatFont(rcjkfont, glyphs, optimizeSpeed=False):
             )
         )
 
+    printMasterStats()
+    printCu2QuStats()
+    if iupTolerance is not None:
+        printIupStats(fbVariations)
+
     fb.setupFvar(fvarAxes, [])
     fb.setupGlyf(fbGlyphs, validateGlyphFormat=False)
     fb.setupGvar(fbVariations)
     fixLsb(fb)
     fb.font.cfg.set("fontTools.ttLib:OPTIMIZE_FONT_SPEED", optimizeSpeed)
+    if jobs != 1:
+        print("Compiling flat.ttf glyphs")
+        precompileGlyfGvar(fb, jobs)
     print("Saving flat.ttf")
     fb.save("flat.ttf")
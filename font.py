@@ -1,5 +1,4 @@
 from fontTools.fontBuilder import FontBuilder
-from fontTools.varLib.models import piecewiseLinearMap
 
 
 async def createFontBuilder(rcjkfont, family_name, style, glyphs, glyphDataFormat=0):
@@ -63,8 +62,3 @@ def recalcSimpleGlyphBounds(fb):
         glyph = glyf.glyphs[glyphname]
         if not hasattr(glyph, "data"):
             glyph.recalcBounds(glyf)
-
-
-def mapTuple(t, mapping):
-    mapping = dict(mapping)
-    return tuple(piecewiseLinearMap(v, mapping) for v in t)
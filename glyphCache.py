@@ -0,0 +1,180 @@
+from memoryBackend import MemoryBackend
+from rcjkFiles import scanFiles, readGlyphName
+
+from importlib import metadata
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+
+_MAGIC = b"RCJKGLC2"  # also the format version
+_HEADER = struct.Struct(">8s20sQQ")  # magic, version tag, index offset, length
+_PACKAGES = ["fontra", "fontra-rcjk"]  # whose classes the cache pickles
+
+
+def _packageVersion(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def versionTag():
+    """A hash of the versions of _PACKAGES."""
+    versions = ["%s=%s" % (name, _packageVersion(name)) for name in _PACKAGES]
+    return hashlib.sha1(";".join(versions).encode("utf-8")).digest()
+
+
+class GlyphCacheBackend(MemoryBackend):
+    """A MemoryBackend that also keeps parsed glyphs in a binary cache file
+    between runs, so that .glif files are only parsed again when they change.
+
+    The cache file is memory-mapped: a header, one pickled glyph after the
+    other, and an index of the glyph offsets and of the .glif files they were
+    read from. A cached glyph is used as long as all its .glif files keep
+    their modification time and size. The header holds the format version
+    and a hash of the fontra and fontra-rcjk versions; the cache is thrown
+    away when either doesn't match. Glyphs without a .glif file are never
+    cached."""
+
+    def __init__(self, backend, rcjk_path, cachePath):
+        super().__init__(backend)
+        self.rcjk_path = rcjk_path
+        self.cachePath = cachePath
+        self._file = None
+        self._mmap = None
+        self._index = {}
+        self._files = {}
+        self._tracked = set()
+        self._newGlyphs = {}
+        self._dirty = False
+        self._open()
+
+    def _readCache(self):
+        try:
+            self._file = open(self.cachePath, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, tag, indexOffset, indexLength = _HEADER.unpack_from(self._mmap, 0)
+            if magic != _MAGIC or tag != versionTag():
+                print(
+                    "Glyph cache: %s was written by another version; "
+                    "not using it" % self.cachePath
+                )
+                raise ValueError("Not a usable glyph cache file: %s" % self.cachePath)
+            index = pickle.loads(self._mmap[indexOffset : indexOffset + indexLength])
+            return index["files"], index["glyphs"]
+        except (OSError, ValueError, EOFError, struct.error, pickle.PickleError):
+            self.close()
+            return {}, {}
+
+    def _open(self):
+        cachedFiles, cachedGlyphs = self._readCache()
+
+        files = {
+            os.path.relpath(path, self.rcjk_path): stat
+            for path, stat in scanFiles(self.rcjk_path).items()
+            if path.endswith(".glif")
+        }
+
+        invalid = set()
+        for relpath, stat in files.items():
+            cached = cachedFiles.get(relpath)
+            if cached is not None and cached[:2] == stat:
+                glyphName = cached[2]
+            else:
+                glyphName = readGlyphName(os.path.join(self.rcjk_path, relpath))
+                if glyphName is None:
+                    # Can't tell which glyph this file belongs to
+                    print("Glyph cache: unreadable glyph file", relpath)
+                    cachedGlyphs = {}
+                    continue
+                invalid.add(glyphName)
+            self._files[relpath] = stat + (glyphName,)
+        for relpath, (mtime, size, glyphName) in cachedFiles.items():
+            if relpath not in files:
+                invalid.add(glyphName)
+
+        # Glyphs without a .glif file can't be checked; don't cache them
+        self._tracked = {glyphName for mtime, size, glyphName in self._files.values()}
+        self._index = {
+            glyphName: entry
+            for glyphName, entry in cachedGlyphs.items()
+            if glyphName not in invalid and glyphName in self._tracked
+        }
+        self._dirty = self._files != cachedFiles or len(self._index) != len(
+            cachedGlyphs
+        )
+        print(
+            "Glyph cache: %d glyphs cached, %d invalidated"
+            % (len(self._index), len(cachedGlyphs) - len(self._index))
+        )
+
+    def reload(self, backend, glyphNames=None):
+        """Like MemoryBackend.reload(), then check the cache file against
+        the .glif files again. Glyphs loaded since the last save() are
+        dropped from the cache."""
+        super().reload(backend, glyphNames)
+        self.close()
+        self._index = {}
+        self._files = {}
+        self._tracked = set()
+        self._newGlyphs = {}
+        self._dirty = False
+        self._open()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def getGlyph(self, glyphName):
+        if glyphName in self.glyphs:
+            return self.glyphs[glyphName]
+
+        entry = self._index.get(glyphName)
+        if entry is not None:
+            offset, length = entry
+            glyph = pickle.loads(self._mmap[offset : offset + length])
+        else:
+            glyph = await self.backend.getGlyph(glyphName)
+            if glyph is not None and glyphName in self._tracked:
+                self._newGlyphs[glyphName] = glyph
+                self._dirty = True
+
+        self.glyphs[glyphName] = glyph
+        return glyph
+
+    def save(self):
+        """Write the cache file, adding the glyphs loaded from the backend."""
+        if not self._dirty:
+            self.close()
+            return
+
+        tmpPath = self.cachePath + ".tmp"
+        with open(tmpPath, "wb") as f:
+            tag = versionTag()
+            f.write(_HEADER.pack(_MAGIC, tag, 0, 0))
+            glyphs = {}
+            for glyphName, (offset, length) in self._index.items():
+                glyphs[glyphName] = (f.tell(), length)
+                f.write(self._mmap[offset : offset + length])
+            for glyphName, glyph in self._newGlyphs.items():
+                data = pickle.dumps(glyph, protocol=pickle.HIGHEST_PROTOCOL)
+                glyphs[glyphName] = (f.tell(), len(data))
+                f.write(data)
+            indexOffset = f.tell()
+            index = pickle.dumps(
+                {"files": self._files, "glyphs": glyphs},
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+            f.write(index)
+            f.seek(0)
+            f.write(_HEADER.pack(_MAGIC, tag, indexOffset, len(index)))
+
+        self.close()
+        os.replace(tmpPath, self.cachePath)
+        print("Glyph cache: saved %d glyphs to %s" % (len(glyphs), self.cachePath))
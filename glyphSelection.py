@@ -0,0 +1,51 @@
+from fnmatch import fnmatchcase
+
+
+class EmptySelectionError(ValueError):
+    pass
+
+
+def parseUnicodes(spec):
+    """Parse a comma-separated list of hex code points and ranges, such as
+    "4E00-4FFF,U+3400", into a list of (first, last) tuples."""
+    ranges = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        first, sep, last = item.partition("-")
+        try:
+            first = int(_stripPrefix(first), 16)
+            last = int(_stripPrefix(last), 16) if sep else first
+        except ValueError:
+            raise ValueError("Invalid Unicode range %r in %r" % (item, spec))
+        if last < first:
+            raise ValueError("Invalid Unicode range %r in %r" % (item, spec))
+        ranges.append((first, last))
+    return ranges
+
+
+def _stripPrefix(value):
+    value = value.strip()
+    if value[:2].upper() in ("U+", "0X"):
+        value = value[2:]
+    return value
+
+
+def selectGlyphs(revCmap, glyphNames=(), unicodes=None, pattern=None):
+    """Return the given glyph names, followed by the glyphs of the font's
+    glyph map that have a code point in the unicodes ranges or a name
+    matching the glob-style pattern."""
+    selected = dict.fromkeys(glyphNames)
+    for glyphName, codepoints in revCmap.items():
+        if glyphName in selected:
+            continue
+        if pattern is not None and fnmatchcase(glyphName, pattern):
+            selected[glyphName] = None
+        elif unicodes is not None and any(
+            first <= codepoint <= last
+            for codepoint in codepoints
+            for first, last in unicodes
+        ):
+            selected[glyphName] = None
+    return list(selected)
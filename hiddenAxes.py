@@ -0,0 +1,131 @@
+from rcjkTools import *
+from normalizer import cachedAxesNormalizer
+
+from fontTools.varLib.models import VariationModel
+from collections import defaultdict
+
+
+def _regionKey(support):
+    return tuple(sorted(support.items()))
+
+
+def glyphAxes(glyph, fontAxes):
+    axes = dict(fontAxes)
+    axes.update(
+        {
+            axis.name: (axis.minValue, axis.defaultValue, axis.maxValue)
+            for axis in glyph.axes
+        }
+    )
+    return axes
+
+
+def sortedAxesMap(axesNames, publicAxes, fvarTags):
+    # Assign private axes to hidden axes in sorted name order.
+    axesMap = {}
+    i = 0
+    for name in sorted(axesNames):
+        if name in publicAxes:
+            axesMap[name] = publicAxes[name]
+        elif name in fvarTags:
+            axesMap[name] = name
+        else:
+            while "%04d" % i in axesNames:
+                i += 1
+            axesMap[name] = "%04d" % i
+            i += 1
+    return axesMap
+
+
+def _glyphSupports(glyph, axes):
+    glyph_masters = glyphMasters(glyph)
+    if len(glyph_masters) < 2:
+        return []
+    masterLocs = cachedAxesNormalizer(axes).normalizeLocations(
+        (dictifyLocation(l) for l in glyph_masters.keys()), validate=True
+    )
+    model = VariationModel(masterLocs, list(axes.keys()))
+    return [support for support in model.supports if support]
+
+
+def countRegions(glyphSupports, axesMaps):
+    regions = set()
+    for glyphName, supports in glyphSupports.items():
+        axesMap = axesMaps[glyphName]
+        for support in supports:
+            regions.add(_regionKey({axesMap[k]: v for k, v in support.items()}))
+    return len(regions)
+
+
+def allocateHiddenAxes(glyphs, fontAxes, publicAxes, fvarTags):
+    """Map each glyph's private axes to the hidden %04d axes such that
+    glyphs share as many variation regions as possible.
+
+    Returns a dict of glyph name to axes map, as well as the number of
+    regions before (sorted allocation) and after."""
+
+    hiddenTags = [tag for tag in fvarTags if tag not in publicAxes.values()]
+
+    glyphSupports = {}
+    sortedMaps = {}
+    for glyphName, glyph in glyphs.items():
+        axes = glyphAxes(glyph, fontAxes)
+        glyphSupports[glyphName] = _glyphSupports(glyph, axes)
+        sortedMaps[glyphName] = sortedAxesMap(axes.keys(), publicAxes, fvarTags)
+
+    # Greedy: place the glyphs with the most regions first, one axis at a
+    # time, onto the hidden axis where its regions are most often used already.
+    regionUsers = defaultdict(int)
+    axisRegionUsers = defaultdict(int)
+    axesMaps = {}
+    order = sorted(glyphs.keys(), key=lambda g: (-len(glyphSupports[g]), g))
+    for glyphName in order:
+        axes = glyphAxes(glyphs[glyphName], fontAxes)
+        supports = glyphSupports[glyphName]
+
+        axesMap = {}
+        private = []
+        for name in axes:
+            if name in publicAxes:
+                axesMap[name] = publicAxes[name]
+            elif name in fvarTags:
+                axesMap[name] = name
+            else:
+                private.append(name)
+        freeTags = [tag for tag in hiddenTags if tag not in axes]
+        assert len(private) <= len(freeTags), (glyphName, private, freeTags)
+
+        axisSupports = defaultdict(list)
+        for support in supports:
+            for name in support:
+                axisSupports[name].append(support)
+        private.sort(key=lambda name: (-len(axisSupports[name]), name))
+
+        for name in private:
+            bestTag, bestScore = None, None
+            for tag in freeTags:
+                axesMap[name] = tag
+                full = 0
+                partial = 0
+                for support in axisSupports[name]:
+                    partial += axisRegionUsers[(tag, support[name])]
+                    if all(k in axesMap for k in support):
+                        key = _regionKey({axesMap[k]: v for k, v in support.items()})
+                        full += regionUsers[key]
+                score = (full, partial)
+                if bestScore is None or score > bestScore:
+                    bestTag, bestScore = tag, score
+            axesMap[name] = bestTag
+            freeTags.remove(bestTag)
+
+        for support in supports:
+            regionUsers[_regionKey({axesMap[k]: v for k, v in support.items()})] += 1
+            for name, triple in support.items():
+                axisRegionUsers[(axesMap[name], triple)] += 1
+
+        axesMaps[glyphName] = axesMap
+
+    before = countRegions(glyphSupports, sortedMaps)
+    after = countRegions(glyphSupports, axesMaps)
+
+    return axesMaps, before, after
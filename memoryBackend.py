@@ -0,0 +1,66 @@
+class MemoryBackend:
+    """Wrap a font backend, keeping the glyphs and font-level data it
+    returns in memory such that each is only loaded once."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.glyphs = {}
+        self._glyphMap = None
+        self._axes = None
+        self._unitsPerEm = None
+
+    def reload(self, backend, glyphNames=None):
+        """Switch to a fresh backend, forgetting the given glyphs, or
+        everything if glyphNames is None."""
+        self.backend = backend
+        self._glyphMap = None
+        if glyphNames is None:
+            self.glyphs.clear()
+            self._axes = None
+            self._unitsPerEm = None
+            return
+        for glyphName in glyphNames:
+            self.glyphs.pop(glyphName, None)
+
+    async def getGlyphMap(self):
+        if self._glyphMap is None:
+            self._glyphMap = await self.backend.getGlyphMap()
+        return self._glyphMap
+
+    async def getAxes(self):
+        if self._axes is None:
+            self._axes = await self.backend.getAxes()
+        return self._axes
+
+    async def getUnitsPerEm(self):
+        if self._unitsPerEm is None:
+            self._unitsPerEm = await self.backend.getUnitsPerEm()
+        return self._unitsPerEm
+
+    async def getGlyph(self, glyphName):
+        if glyphName not in self.glyphs:
+            self.glyphs[glyphName] = await self.backend.getGlyph(glyphName)
+        return self.glyphs[glyphName]
+
+
+class GlyphTableBackend:
+    """A read-only backend over an in-memory glyph table. Unlike a
+    MemoryBackend, it is picklable, so it can be sent to worker processes."""
+
+    def __init__(self, glyphs, axes, unitsPerEm):
+        self.glyphs = glyphs
+        self.axes = axes
+        self.unitsPerEm = unitsPerEm
+
+    @classmethod
+    async def fromBackend(cls, backend, glyphs):
+        return cls(dict(glyphs), await backend.getAxes(), await backend.getUnitsPerEm())
+
+    async def getAxes(self):
+        return self.axes
+
+    async def getUnitsPerEm(self):
+        return self.unitsPerEm
+
+    async def getGlyph(self, glyphName):
+        return self.glyphs.get(glyphName)
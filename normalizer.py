@@ -0,0 +1,185 @@
+from fontTools.varLib.models import piecewiseLinearMap
+from functools import lru_cache
+
+import numpy as np
+
+
+class AxisNormalizer:
+    """Normalize values of one axis: map user values through the axis
+    mapping, if any, to source values, then those to -1..0..1 by the
+    axis minimum, default and maximum. Gives the same results as
+    fontTools' piecewiseLinearMap() and normalizeValue()."""
+
+    def __init__(self, minValue, defaultValue, maxValue, mapping=()):
+        mapping = dict(mapping)
+        self.mapping = mapping
+        self.triple = tuple(
+            piecewiseLinearMap(v, mapping) for v in (minValue, defaultValue, maxValue)
+        )
+        lower, default, upper = self.triple
+        if not lower <= default <= upper:
+            raise ValueError(
+                "Invalid axis values, must be minimum, default, maximum: "
+                "%3.3f, %3.3f, %3.3f" % self.triple
+            )
+        self.lower, self.default, self.upper = lower, default, upper
+        # The divisors of normalizeValue(); zero for a side the axis doesn't
+        # have, which is never divided by
+        self.negativeDivisor = default - lower
+        self.positiveDivisor = upper - default
+
+    def mapValue(self, value):
+        """Map a user value to a source value."""
+        return piecewiseLinearMap(value, self.mapping) if self.mapping else value
+
+    def normalizeValue(self, value):
+        """Normalize a source value."""
+        lower, default, upper = self.lower, self.default, self.upper
+        value = max(min(value, upper), lower)
+        if value == default or lower == upper:
+            return 0.0
+        if value < default:
+            return (value - default) / self.negativeDivisor
+        return (value - default) / self.positiveDivisor
+
+
+class AxesNormalizer:
+    """Normalize locations over a fixed set of axes, given as a dict of
+    axis name to (minimum, default, maximum) source values or to
+    AxisNormalizer. Build it once and reuse it for all the locations to
+    normalize, or get a shared one with cachedAxesNormalizer(). Whole
+    (locations × axes) arrays are normalized at once with numpy."""
+
+    # Number of location values from which numpy beats normalizing one
+    # location at a time
+    arrayThreshold = 256
+
+    def __init__(self, axes):
+        self.axisNormalizers = {
+            name: (axis if isinstance(axis, AxisNormalizer) else AxisNormalizer(*axis))
+            for name, axis in axes.items()
+        }
+        self.axes = {name: axis.triple for name, axis in self.axisNormalizers.items()}
+        self.axisNames = list(self.axes)
+        self._axisIndices = {name: i for i, name in enumerate(self.axisNames)}
+        triples = np.array(list(self.axes.values()), dtype=float).reshape(-1, 3)
+        self._lower, self._default, self._upper = triples.T
+        self._axisItems = [
+            (
+                name,
+                axis.lower,
+                axis.default,
+                axis.upper,
+                axis.negativeDivisor,
+                axis.positiveDivisor,
+            )
+            for name, axis in self.axisNormalizers.items()
+        ]
+
+    @classmethod
+    def fromFontAxes(cls, fontAxes, glyphAxes=()):
+        """For the fontra font axes, with their mappings, and the given
+        glyph axes, which override font axes of the same name."""
+        axes = {
+            axis.name: AxisNormalizer(
+                axis.minValue, axis.defaultValue, axis.maxValue, axis.mapping
+            )
+            for axis in fontAxes
+        }
+        axes.update(
+            {
+                axis.name: AxisNormalizer(
+                    axis.minValue, axis.defaultValue, axis.maxValue
+                )
+                for axis in glyphAxes
+            }
+        )
+        return cls(axes)
+
+    def normalizeLocation(self, location, validate=False):
+        """Like fontTools' normalizeLocation(); axes missing from location
+        are at their default."""
+        if validate:
+            for name in location:
+                if name not in self.axisNormalizers:
+                    raise AssertionError(
+                        "Unknown axis %r in location %r" % (name, location)
+                    )
+        # AxisNormalizer.normalizeValue(), inlined
+        out = {}
+        for name, lower, default, upper, negative, positive in self._axisItems:
+            value = location.get(name)
+            if value is None or lower == upper:
+                out[name] = 0.0
+                continue
+            value = max(min(value, upper), lower)
+            if value == default:
+                out[name] = 0.0
+            elif value < default:
+                out[name] = (value - default) / negative
+            else:
+                out[name] = (value - default) / positive
+        return out
+
+    def locationsToArray(self, locations, validate=False):
+        """A (locations × axes) array of source values; missing axes are at
+        their default."""
+        values = np.tile(self._default, (len(locations), 1))
+        for row, location in zip(values, locations):
+            for name, value in location.items():
+                i = self._axisIndices.get(name)
+                if i is None:
+                    if validate:
+                        raise AssertionError(
+                            "Unknown axis %r in location %r" % (name, location)
+                        )
+                    continue
+                row[i] = value
+        return values
+
+    def normalizeArray(self, values):
+        """Normalize a (locations × axes) array of source values."""
+        lower, default, upper = self._lower, self._default, self._upper
+        values = np.clip(values, lower, upper)
+        delta = values - default
+        # Same as (v - default) / (default - lower) etc., not multiplying by
+        # the reciprocal, to get exactly the same floats as fontTools
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out = np.where(
+                values < default, delta / (default - lower), delta / (upper - default)
+            )
+        return np.where((values == default) | (lower == upper), 0.0, out)
+
+    def normalizeLocations(self, locations, validate=False):
+        """Normalize a list of location dicts. Large batches are normalized
+        as one (locations × axes) array with numpy, small ones one location
+        at a time, which is faster for them."""
+        locations = list(locations)
+        if len(locations) * len(self.axisNames) < self.arrayThreshold:
+            return [
+                self.normalizeLocation(location, validate) for location in locations
+            ]
+        normalized = self.normalizeArray(self.locationsToArray(locations, validate))
+        return [dict(zip(self.axisNames, row)) for row in normalized.tolist()]
+
+    def mapUserLocation(self, location):
+        """Map a location of user values to source values."""
+        return {
+            name: (
+                self.axisNormalizers[name].mapValue(value)
+                if name in self.axisNormalizers
+                else value
+            )
+            for name, value in location.items()
+        }
+
+
+def cachedAxesNormalizer(axes):
+    """A shared AxesNormalizer for axes, a dict of axis name to (minimum,
+    default, maximum); glyphs with the same axes share one."""
+    return _cachedAxesNormalizer(tuple(axes.items()))
+
+
+@lru_cache(maxsize=1024)
+def _cachedAxesNormalizer(axesItems):
+    return AxesNormalizer(dict(axesItems))
@@ -0,0 +1,113 @@
+from fontTools.ttLib import OPTIMIZE_FONT_SPEED
+from fontTools.ttLib.tables._g_l_y_f import Glyph
+from fontTools.ttLib.tables._g_v_a_r import table__g_v_a_r, compileGlyph_
+from fontTools.ttLib.tables.TupleVariation import compileSharedTuples
+from workerPool import poolChunks, workerPool
+import itertools
+
+
+class PrecompiledGlyph(Glyph):
+    """A glyf glyph that keeps its expanded data, for maxp, hhea etc., but
+    compiles to data that was packed ahead of time."""
+
+    def compile(self, glyfTable, recalcBBoxes=True, **kwargs):
+        return self.compiledData
+
+
+class PrecompiledGvar(table__g_v_a_r):
+    """A gvar table whose glyph variation data was packed ahead of time."""
+
+    def compileGlyphs_(self, ttFont, axisTags, sharedCoordIndices):
+        if sharedCoordIndices != self.compiledSharedCoordIndices:
+            return super().compileGlyphs_(ttFont, axisTags, sharedCoordIndices)
+        return [self.compiledGlyphs.get(g, b"") for g in ttFont.getGlyphOrder()]
+
+
+def _compileGlyfChunk(glyphs, recalcBBoxes, optimizeSize):
+    # Simple glyphs don't need the glyf table to compile
+    return [
+        glyph.compile(None, recalcBBoxes, optimizeSize=optimizeSize) for glyph in glyphs
+    ]
+
+
+def _compileGvarChunk(
+    dataOffsetSize, allVariations, axisTags, sharedCoordIndices, optimizeSize
+):
+    return [
+        compileGlyph_(
+            dataOffsetSize,
+            variations,
+            0,  # pointCount is unused
+            axisTags,
+            sharedCoordIndices,
+            optimizeSize=optimizeSize,
+        )
+        for variations in allVariations
+    ]
+
+
+def precompileGlyfGvar(fb, jobs=None):
+    """Pack the glyf glyphs and gvar glyph variation data of a FontBuilder
+    font in a pool of jobs worker processes. Call right before fb.save(),
+    once the glyphs and variations won't change anymore."""
+
+    font = fb.font
+    optimizeSize = not font.cfg[OPTIMIZE_FONT_SPEED]
+    glyf = font["glyf"]
+    oldGvar = font["gvar"]
+    axisTags = [axis.axisTag for axis in font["fvar"].axes]
+
+    # Composite glyphs need the glyf table for their bounds; leave them be
+    glyfNames = [
+        glyphName
+        for glyphName in font.getGlyphOrder()
+        if not glyf.glyphs[glyphName].isComposite()
+    ]
+    gvarNames = [
+        glyphName for glyphName, variations in oldGvar.variations.items() if variations
+    ]
+
+    # Same as table__g_v_a_r.compile()
+    sharedTuples = compileSharedTuples(
+        axisTags, itertools.chain(*oldGvar.variations.values())
+    )
+    sharedCoordIndices = {coord: i for i, coord in enumerate(sharedTuples)}
+
+    with workerPool(jobs) as executor:
+        glyfChunks = poolChunks(glyfNames, jobs, maxSize=None)
+        glyfFutures = [
+            executor.submit(
+                _compileGlyfChunk,
+                [glyf.glyphs[glyphName] for glyphName in chunk],
+                font.recalcBBoxes,
+                optimizeSize,
+            )
+            for chunk in glyfChunks
+        ]
+        gvarChunks = poolChunks(gvarNames, jobs, maxSize=None)
+        gvarFutures = [
+            executor.submit(
+                _compileGvarChunk,
+                oldGvar.gid_size,
+                [oldGvar.variations[glyphName] for glyphName in chunk],
+                axisTags,
+                sharedCoordIndices,
+                optimizeSize,
+            )
+            for chunk in gvarChunks
+        ]
+
+        for chunk, future in zip(glyfChunks, glyfFutures):
+            for glyphName, data in zip(chunk, future.result()):
+                glyph = PrecompiledGlyph()
+                glyph.__dict__.update(glyf.glyphs[glyphName].__dict__)
+                glyph.compiledData = data
+                glyf.glyphs[glyphName] = glyph
+
+        gvar = PrecompiledGvar("gvar")
+        gvar.__dict__.update(oldGvar.__dict__)
+        gvar.compiledSharedCoordIndices = sharedCoordIndices
+        gvar.compiledGlyphs = {}
+        for chunk, future in zip(gvarChunks, gvarFutures):
+            gvar.compiledGlyphs.update(zip(chunk, future.result()))
+        font["gvar"] = gvar
@@ -0,0 +1,33 @@
+from xml.sax.saxutils import unescape
+import os
+import re
+
+_glyphNameRE = re.compile(rb'<glyph\s[^>]*?name="([^"]*)"')
+
+
+def scanFiles(rcjk_path):
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(rcjk_path):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for filename in filenames:
+            if filename.startswith("."):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files[path] = (st.st_mtime_ns, st.st_size)
+    return files
+
+
+def readGlyphName(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read(4096)
+    except FileNotFoundError:
+        return None
+    m = _glyphNameRE.search(data)
+    if m is None:
+        return None
+    return unescape(m.group(1).decode("utf-8"), {"&quot;": '"'})
@@ -1,3 +1,6 @@
+from fontTools.pens.recordingPen import RecordingPointPen
+
+
 def tuplifyLocation(loc):
     return tuple(sorted(loc.items()))
 
@@ -16,3 +19,74 @@ def glyphMasters(glyph):
         masters[locationTuple] = glyph.layers[source.layerName]
 
     return masters
+
+
+def layerGeometryKey(layer, components=True):
+    """A hashable key of the layer's geometry: its outline points and,
+    with components, the components' names, transformations and locations.
+    Layers with the same key draw the same."""
+    pen = RecordingPointPen()
+    layer.glyph.path.drawPoints(pen)
+    key = tuple(
+        (op, tuple(args), tuple(sorted(kwargs.items())))
+        for op, args, kwargs in pen.value
+    )
+    if not components:
+        return key
+    return key, tuple(
+        (
+            component.name,
+            _transformTuple(component.transformation),
+            tuplifyLocation(component.location),
+        )
+        for component in layer.glyph.components
+    )
+
+
+def _transformTuple(t):
+    return (
+        t.translateX,
+        t.translateY,
+        t.rotation,
+        t.scaleX,
+        t.scaleY,
+        t.skewX,
+        t.skewY,
+        t.tCenterX,
+        t.tCenterY,
+    )
+
+
+def closureGlyph(fetched, glyphs, glyph):
+    assert glyph.sources[0].name == "<default>"
+    assert glyph.sources[0].layerName == "foreground"
+    layer = glyph.layers["foreground"]
+    for component in layer.glyph.components:
+        if component.name not in glyphs:
+            componentGlyph = fetched.get(component.name)
+            if componentGlyph is None:
+                print("Missing component", component.name, "in glyph", glyph.name)
+                continue
+            glyphs[component.name] = componentGlyph
+            closureGlyph(fetched, glyphs, componentGlyph)
+
+
+async def closureGlyphs(rcjkfont, glyphs):
+    """Add the components used by glyphs to it, recursively."""
+
+    # Fetch each component only once
+    fetched = {}
+    pending = list(glyphs.values())
+    while pending:
+        glyph = pending.pop()
+        for component in glyph.layers["foreground"].glyph.components:
+            name = component.name
+            if name in glyphs or name in fetched:
+                continue
+            componentGlyph = fetched[name] = await rcjkfont.getGlyph(name)
+            if componentGlyph is not None:
+                pending.append(componentGlyph)
+
+    # Then add them depth-first, for a stable glyph order
+    for glyph in list(glyphs.values()):
+        closureGlyph(fetched, glyphs, glyph)
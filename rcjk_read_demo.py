@@ -4,25 +4,214 @@
 # See src/fontra/core/classes.py in the fontra repo for the data structure
 # PackedPath objects have a drawPoints method that takes a point pen
 
+# With --export, the glyphs are streamed as newline-delimited JSON, one glyph
+# per line, for piping into other tools. The "json" format is asdict() of the
+# glyph. The "packed" format keeps the glyph's axes and sources as they are,
+# but gives each layer as:
+#
+#   xAdvance
+#   coordinates: base64 of the x, y pairs of all points, as little-endian
+#                float32 values
+#   pointTypes: one character per point: "m" move, "l" line, "c" curve,
+#               "q" qcurve, "." off-curve; upper case if smooth
+#   contourEnds: index of the last point of each contour
+#   components: name, transformation and location of each component
+
 
 import argparse
 import asyncio
+import base64
+import bz2
+import gzip
+import lzma
+from collections import deque
 from dataclasses import asdict
 import json
+import os
 import sys
+import numpy as np
+from fontTools.pens.recordingPen import RecordingPointPen
 from fontra_rcjk.backend_fs import RCJKBackend
+from glyphSelection import parseUnicodes, selectGlyphs
+
+compressors = {"gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+compressorExtensions = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz"}
+
+pointTypeCodes = {None: ".", "move": "m", "line": "l", "curve": "c", "qcurve": "q"}
+
+
+def packStaticGlyph(staticGlyph):
+    pen = RecordingPointPen()
+    staticGlyph.path.drawPoints(pen)
+    coordinates = []
+    pointTypes = []
+    contourEnds = []
+    for op, args, kwargs in pen.value:
+        if op == "addPoint":
+            pt, segmentType, smooth, name = args
+            coordinates.extend(pt)
+            code = pointTypeCodes[segmentType]
+            pointTypes.append(code.upper() if smooth else code)
+        elif op == "endPath":
+            contourEnds.append(len(pointTypes) - 1)
+    return {
+        "xAdvance": staticGlyph.xAdvance,
+        "coordinates": base64.b64encode(
+            np.asarray(coordinates, dtype="<f4").tobytes()
+        ).decode("ascii"),
+        "pointTypes": "".join(pointTypes),
+        "contourEnds": contourEnds,
+        "components": [
+            {
+                "name": component.name,
+                "transformation": asdict(component.transformation),
+                "location": dict(component.location),
+            }
+            for component in staticGlyph.components
+        ],
+    }
+
+
+def packGlyph(glyph):
+    return {
+        "name": glyph.name,
+        "axes": [asdict(axis) for axis in glyph.axes],
+        "sources": [asdict(source) for source in glyph.sources],
+        "layers": {
+            layerName: packStaticGlyph(layer.glyph)
+            for layerName, layer in glyph.layers.items()
+        },
+    }
+
+
+async def iterGlyphs(backend, glyphNames, concurrency):
+    """Yield the glyphs of glyphNames in order, loading up to concurrency
+    glyphs at a time; only those are held in memory."""
+    pending = deque()
+    for glyphName in glyphNames:
+        pending.append((glyphName, asyncio.ensure_future(backend.getGlyph(glyphName))))
+        if len(pending) >= concurrency:
+            glyphName, future = pending.popleft()
+            yield glyphName, await future
+    while pending:
+        glyphName, future = pending.popleft()
+        yield glyphName, await future
+
+
+def openOutput(path, compress):
+    if compress is None and path != "-":
+        for extension, name in compressorExtensions.items():
+            if path.endswith(extension):
+                compress = name
+    if path == "-":
+        if compress is None:
+            return sys.stdout
+        return compressors[compress](sys.stdout.buffer, "wt", encoding="utf-8")
+    if compress is None:
+        return open(path, "w", encoding="utf-8")
+    return compressors[compress](path, "wt", encoding="utf-8")
+
+
+async def exportGlyphs(backend, glyphNames, output, packed=False, concurrency=32):
+    count = 0
+    async for glyphName, glyph in iterGlyphs(backend, glyphNames, concurrency):
+        if glyph is None:
+            print("Missing glyph", glyphName, file=sys.stderr)
+            continue
+        data = packGlyph(glyph) if packed else asdict(glyph)
+        output.write(json.dumps(data, separators=(",", ":")))
+        output.write("\n")
+        count += 1
+    return count
 
 
 async def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("rcjk_path")
-    parser.add_argument("glyph_name")
+    parser.add_argument(
+        "glyph_names",
+        nargs="*",
+        help="Glyphs to dump; with --export, glyphs to export (default: all, "
+        "unless --unicodes or --glyph-pattern is given)",
+    )
+    parser.add_argument(
+        "--export",
+        type=str,
+        metavar="OUTPUT",
+        help="Stream the glyphs as newline-delimited JSON to this file, or to "
+        "standard output if '-' (default: dump the given glyphs)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "packed"],
+        default="json",
+        help="Export the full glyph data, or packed coordinate arrays "
+        "(default: json)",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=sorted(compressors),
+        help="Compress the export (default: from the OUTPUT extension, "
+        ".gz, .bz2 or .xz)",
+    )
+    parser.add_argument(
+        "--unicodes",
+        type=parseUnicodes,
+        help="Add the glyphs for these code points to the glyphs to export, given "
+        "as hex values and ranges, e.g. 4E00-4FFF,U+3400 (default: none)",
+    )
+    parser.add_argument(
+        "--glyph-pattern",
+        type=str,
+        help="Add the glyphs with names matching this glob-style pattern to the "
+        "glyphs to export, e.g. 'uni4E*' (default: none)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=32,
+        help="Number of glyphs to load at a time when exporting (default: 32)",
+    )
     args = parser.parse_args()
     backend = RCJKBackend.fromPath(args.rcjk_path)
     revCmap = await backend.getGlyphMap()
-    print(sorted(revCmap)[:100])
-    glyph = await backend.getGlyph(args.glyph_name)
-    print(json.dumps(asdict(glyph), indent=2))
+
+    if args.export is None:
+        if not args.glyph_names:
+            parser.error("give glyph names to dump, or --export")
+        print(sorted(revCmap)[:100])
+        for glyphName in args.glyph_names:
+            glyph = await backend.getGlyph(glyphName)
+            print(json.dumps(asdict(glyph), indent=2))
+        return
+
+    if args.unicodes is not None or args.glyph_pattern is not None:
+        glyphNames = selectGlyphs(
+            revCmap, args.glyph_names, args.unicodes, args.glyph_pattern
+        )
+        if not glyphNames:
+            parser.error("No glyphs match the given --unicodes or --glyph-pattern")
+    else:
+        glyphNames = args.glyph_names or revCmap.keys()
+
+    try:
+        output = openOutput(args.export, args.compress)
+        count = await exportGlyphs(
+            backend,
+            glyphNames,
+            output,
+            packed=args.format == "packed",
+            concurrency=max(1, args.concurrency),
+        )
+        if output is sys.stdout:
+            output.flush()
+        else:
+            output.close()
+    except BrokenPipeError:
+        # The reader went away, as with `| head`; stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    print("Exported %d glyphs" % count, file=sys.stderr)
 
 
 asyncio.run(main())
@@ -0,0 +1,160 @@
+from font import createFontBuilder, fixLsb
+from decompose import Decomposer, DecompositionCache
+from memoryBackend import GlyphTableBackend
+from normalizer import AxesNormalizer
+from rcjkTools import closureGlyphs
+from workerPool import poolChunks, workerPool, workerState
+
+from fontTools.pens.recordingPen import RecordingPointPen
+from fontTools.pens.ttGlyphPen import TTGlyphPointPen
+from fontTools.pens.cu2quPen import Cu2QuPointPen
+from fontTools.ttLib.tables._g_l_y_f import Glyph
+from fontTools.misc.roundTools import otRound
+import asyncio
+import os
+
+
+def parseInstance(spec):
+    """Parse "Name:axis=value,axis=value" into a name and a location."""
+    name, sep, values = spec.partition(":")
+    if not name or not sep:
+        raise ValueError("Invalid instance %r; expected Name:axis=value,..." % spec)
+    location = {}
+    for item in values.split(","):
+        if not item:
+            continue
+        axis, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError("Invalid instance location %r in %r" % (item, spec))
+        try:
+            location[axis.strip()] = float(value)
+        except ValueError:
+            raise ValueError("Invalid instance value %r in %r" % (value, spec))
+    return name, location
+
+
+async def sourceLocation(rcjkfont, location):
+    # User-space values, keyed by axis name or tag, to the source
+    # coordinates the glyph masters are in.
+    fontAxes = (await rcjkfont.getAxes()).axes
+    out = {}
+    for axis in fontAxes:
+        for key in (axis.name, axis.tag):
+            if key in location:
+                out[axis.name] = location[key]
+                break
+    unknown = set(location) - {
+        key for axis in fontAxes for key in (axis.name, axis.tag)
+    }
+    if unknown:
+        raise ValueError("Unknown axes in instance location: %s" % sorted(unknown))
+    return AxesNormalizer.fromFontAxes(fontAxes).mapUserLocation(out)
+
+
+def buildStaticGlyph(decomposer, glyph, location):
+    recording = decomposer.decomposeGlyph(glyph, location)
+
+    ttPen = TTGlyphPointPen(None)
+    rppen = RecordingPointPen()
+    rppen.value = recording.value
+    rppen.replay(Cu2QuPointPen(ttPen, 1))
+    fbGlyph = ttPen.glyph()
+
+    normalizer, glyph_masters, model = decomposer.glyphModel(glyph)
+    loc = normalizer.normalizeLocation(location)
+    advance = model.interpolateFromMasters(
+        loc, [layer.glyph.xAdvance for layer in glyph_masters.values()]
+    )
+
+    return fbGlyph, max(otRound(advance), 0)
+
+
+def printCacheStats(hits, misses):
+    lookups = hits + misses
+    print(
+        "Decomposition cache: %d hits, %d misses (%.1f%% hits)"
+        % (hits, misses, 100 * hits / lookups if lookups else 0)
+    )
+
+
+def _staticWorkerState(font, locations):
+    decomposer = Decomposer(font.glyphs, font.axes.axes, DecompositionCache())
+    return decomposer, locations
+
+
+def _buildStaticGlyphsChunk(glyphNames):
+    # The worker's cache is kept between its chunks; return the hits and
+    # misses of this chunk only
+    decomposer, locations = workerState()
+    cache = decomposer.cache
+    hits, misses = cache.hits, cache.misses
+    results = [
+        [
+            buildStaticGlyph(decomposer, decomposer.glyphs[glyphName], location)
+            for location in locations
+        ]
+        for glyphName in glyphNames
+    ]
+    return results, (cache.hits - hits, cache.misses - misses)
+
+
+async def buildStaticFonts(rcjkfont, glyphs, instances, jobs=1, outputDir="."):
+    """Build one static flat font per instance, straight from the glyph
+    masters. instances is a list of (name, user-space location) tuples."""
+
+    revCmap = await rcjkfont.getGlyphMap()
+    charGlyphs = {g: v for g, v in glyphs.items() if revCmap[g]}
+
+    names = [name for name, location in instances]
+    locations = [
+        await sourceLocation(rcjkfont, location) for name, location in instances
+    ]
+    print("Building static instances:", " ".join(names))
+
+    glyphNames = list(charGlyphs.keys())
+    results = {}
+    if jobs != 1 and len(glyphNames) > 1:
+        allGlyphs = dict(charGlyphs)
+        await closureGlyphs(rcjkfont, allGlyphs)
+        font = await GlyphTableBackend.fromBackend(rcjkfont, allGlyphs)
+
+        loop = asyncio.get_running_loop()
+        chunks = poolChunks(glyphNames, jobs)
+        print("Processing %d static glyphs in worker processes" % len(glyphNames))
+        with workerPool(jobs, _staticWorkerState, (font, locations)) as executor:
+            futures = [
+                loop.run_in_executor(executor, _buildStaticGlyphsChunk, chunk)
+                for chunk in chunks
+            ]
+            hits = misses = 0
+            for chunk, future in zip(chunks, futures):
+                chunkResults, (chunkHits, chunkMisses) = await future
+                results.update(zip(chunk, chunkResults))
+                hits += chunkHits
+                misses += chunkMisses
+    else:
+        decomposer = await Decomposer.fromBackend(
+            rcjkfont, charGlyphs.values(), cache=DecompositionCache()
+        )
+        for glyphName, glyph in charGlyphs.items():
+            print("Processing static glyph", glyphName)
+            results[glyphName] = [
+                buildStaticGlyph(decomposer, glyph, location) for location in locations
+            ]
+        hits, misses = decomposer.cache.hits, decomposer.cache.misses
+    printCacheStats(hits, misses)
+
+    for i, name in enumerate(names):
+        fb = await createFontBuilder(rcjkfont, "rcjk", name, charGlyphs)
+
+        fbGlyphs = {".notdef": Glyph()}
+        metrics = fb.font["hmtx"].metrics
+        for glyphName in glyphNames:
+            fbGlyphs[glyphName], advance = results[glyphName][i]
+            metrics[glyphName] = (advance, 0)
+
+        fb.setupGlyf(fbGlyphs, validateGlyphFormat=False)
+        fixLsb(fb)
+        path = os.path.join(outputDir, "%s.ttf" % name)
+        print("Saving", path)
+        fb.save(path)
@@ -0,0 +1,163 @@
+from fontTools.varLib.builder import buildMultiVarData, buildMultiVarStore
+from fontTools.ttLib.tables import otTables as ot
+import fontTools.varLib.multiVarStore  # For MultiVarStore.prune_regions()
+from heapq import heapify, heappush, heappop
+
+NO_VARIATION_INDEX = ot.NO_VARIATION_INDEX
+
+
+def _rowVectors(item, regionIndices):
+    # The item's non-zero per-region delta vectors, by region index
+    dim = len(item) // len(regionIndices)
+    vectors = {}
+    for i, regionIndex in enumerate(regionIndices):
+        vector = tuple(item[i * dim : (i + 1) * dim])
+        if any(vector):
+            vectors[regionIndex] = vector
+    return dim, vectors
+
+
+class _Group:
+    """Rows sharing one MultiVarData. Its cost is a rough byte count: the
+    MultiVarData header and region indices, plus about a byte for the
+    zeros of every region a row doesn't use. The latter is also the extra
+    work of looking a row up."""
+
+    def __init__(self, regions, rows, usedRegions):
+        self.regions = regions
+        self.rows = rows
+        self.usedRegions = usedRegions  # Sum over the rows
+
+    def cost(self):
+        return (
+            10
+            + 2 * len(self.regions)
+            + len(self.rows) * len(self.regions)
+            - self.usedRegions
+        )
+
+    def mergedCost(self, other):
+        regions = len(self.regions | other.regions)
+        return (
+            10
+            + 2 * regions
+            + (len(self.rows) + len(other.rows)) * regions
+            - self.usedRegions
+            - other.usedRegions
+        )
+
+    def merge(self, other):
+        return _Group(
+            self.regions | other.regions,
+            self.rows + other.rows,
+            self.usedRegions + other.usedRegions,
+        )
+
+
+def _mergeGroups(groups):
+    # Greedily merge the pair of groups that saves the most, until no merge
+    # saves anything; like fontTools' VarStore.optimize().
+    groups = dict(enumerate(groups))
+    costs = {i: group.cost() for i, group in groups.items()}
+
+    def gain(i, j):
+        return costs[i] + costs[j] - groups[i].mergedCost(groups[j])
+
+    heap = []
+    keys = list(groups)
+    for n, i in enumerate(keys):
+        for j in keys[n + 1 :]:
+            g = gain(i, j)
+            if g > 0:
+                heap.append((-g, i, j))
+    heapify(heap)
+
+    nextKey = len(groups)
+    while heap:
+        g, i, j = heappop(heap)
+        if i not in groups or j not in groups:
+            continue
+        merged = groups.pop(i).merge(groups.pop(j))
+        del costs[i], costs[j]
+        k = nextKey
+        nextKey += 1
+        groups[k] = merged
+        costs[k] = merged.cost()
+        for other in groups:
+            if other != k:
+                g = gain(other, k)
+                if g > 0:
+                    heappush(heap, (-g, other, k))
+
+    return list(groups.values())
+
+
+def optimizeMultiVarStore(store, varIdxes):
+    """Rebuild the MultiVarStore store in place: drop zero region columns,
+    share identical rows, merge MultiVarData whose region sets are close
+    enough that padding with zeros is cheaper than a separate subtable,
+    and order the rows by first use.
+
+    varIdxes lists the variation indices used, in the order they are used.
+    Returns a dict mapping the old variation indices to the new ones."""
+
+    # Unique rows, by their delta vectors
+    rowIds = {}
+    rows = []
+    oldToRow = {}
+    for outer, varData in enumerate(store.MultiVarData):
+        for inner, item in enumerate(varData.Item):
+            dim, vectors = _rowVectors(item, varData.VarRegionIndex)
+            if not vectors:
+                continue
+            key = (dim, tuple(sorted(vectors.items())))
+            rowId = rowIds.get(key)
+            if rowId is None:
+                rowId = rowIds[key] = len(rows)
+                rows.append((dim, vectors))
+            oldToRow[(outer << 16) + inner] = rowId
+
+    # First use of every row
+    firstUse = {}
+    for varIdx in varIdxes:
+        rowId = oldToRow.get(varIdx)
+        if rowId is not None and rowId not in firstUse:
+            firstUse[rowId] = len(firstUse)
+
+    regionSets = {}
+    for rowId in firstUse:
+        regions = frozenset(rows[rowId][1])
+        regionSets.setdefault(regions, []).append(rowId)
+    groups = _mergeGroups(
+        _Group(regions, groupRows, len(regions) * len(groupRows))
+        for regions, groupRows in regionSets.items()
+    )
+
+    # Subtables and rows in order of first use
+    groups.sort(key=lambda group: min(firstUse[rowId] for rowId in group.rows))
+    varDatas = []
+    rowToNew = {}
+    for group in groups:
+        regions = sorted(group.regions)
+        groupRows = sorted(group.rows, key=firstUse.__getitem__)
+        for start in range(0, len(groupRows), 0xFFFF):
+            items = []
+            for inner, rowId in enumerate(groupRows[start : start + 0xFFFF]):
+                dim, vectors = rows[rowId]
+                zeros = (0,) * dim
+                item = []
+                for regionIndex in regions:
+                    item.extend(vectors.get(regionIndex, zeros))
+                items.append(item)
+                rowToNew[rowId] = (len(varDatas) << 16) + inner
+            varDatas.append(buildMultiVarData(regions, items))
+
+    newStore = buildMultiVarStore(store.SparseVarRegionList, varDatas)
+    newStore.prune_regions()
+    store.__dict__.update(newStore.__dict__)
+
+    varIdxMap = {NO_VARIATION_INDEX: NO_VARIATION_INDEX}
+    for varIdx in varIdxes:
+        rowId = oldToRow.get(varIdx)
+        varIdxMap[varIdx] = rowToNew[rowId] if rowId is not None else NO_VARIATION_INDEX
+    return varIdxMap
@@ -1,11 +1,26 @@
 from font import *
 from rcjkTools import *
-from flatFont import buildFlatGlyph
+from flatFont import (
+    buildFlatGlyph,
+    buildAdvanceVariations,
+    printIupStats,
+    printCu2QuStats,
+    printMasterStats,
+    clearStats,
+    collectStats,
+    addStats,
+)
 from component import *
+from hiddenAxes import allocateHiddenAxes, glyphAxes
+from parallelCompile import precompileGlyfGvar
+from memoryBackend import GlyphTableBackend
+from workerPool import poolChunks, workerPool, workerState
+from normalizer import AxesNormalizer, cachedAxesNormalizer
+from varStoreOptimizer import optimizeMultiVarStore
 
 from fontTools.ttLib import newTable
 from fontTools.ttLib.tables._g_l_y_f import Glyph, GlyphCoordinates
-from fontTools.varLib.models import normalizeLocation, VariationModel
+from fontTools.varLib.models import VariationModel
 from fontTools.varLib.multiVarStore import OnlineMultiVarStoreBuilder
 import fontTools.ttLib.tables.otTables as ot
 from fontTools.misc.vector import Vector
@@ -13,26 +28,26 @@ from fontTools.misc.fixedTools import fixedToFloat as fi2fl
 from functools import partial
 from collections import defaultdict
 from fontTools.designspaceLib import AxisDescriptor
+import asyncio
 import struct
 
 
-async def closureGlyph(rcjkfont, glyphs, glyph):
-    assert glyph.sources[0].name == "<default>"
-    assert glyph.sources[0].layerName == "foreground"
-    layer = glyph.layers["foreground"]
-    for component in layer.glyph.components:
-        if component.name not in glyphs:
-            componentGlyph = await rcjkfont.getGlyph(component.name)
-            if componentGlyph is None:
-                print("Missing component", component.name, "in glyph", glyph.name)
-                continue
-            glyphs[component.name] = componentGlyph
-            await closureGlyph(rcjkfont, glyphs, componentGlyph)
+def localityGlyphOrder(glyphs):
+    # Place every glyph right before the components it uses, such that
+    # drawing a glyph touches neighbouring data.
+    ordered = {}
 
+    def visit(glyphName):
+        if glyphName in ordered or glyphName not in glyphs:
+            return
+        glyph = ordered[glyphName] = glyphs[glyphName]
+        for component in glyph.layers["foreground"].glyph.components:
+            visit(component.name)
 
-async def closureGlyphs(rcjkfont, glyphs):
-    for glyph in list(glyphs.values()):
-        await closureGlyph(rcjkfont, glyphs, glyph)
+    for glyphName in glyphs:
+        visit(glyphName)
+
+    return ordered
 
 
 async def setupFvarAxes(rcjkfont, glyphs):
@@ -76,11 +91,210 @@ async def setupFvarAxes(rcjkfont, glyphs):
     return fvarAxes
 
 
-async def buildVarcFont(rcjkfont, glyphs, optimizeSpeed=False):
+class VarcGlyphRecord:
+    """The per-glyph part of a varc.ttf build: the glyph's outline, or
+    else the gvar variations of its advance width, and its component
+    master values. These only depend on the glyph, its
+    components and their axes maps; MultiVarStore and AxisIndicesList
+    entries are made from them in glyph order."""
+
+    def __init__(self):
+        self.key = None
+        self.outline = None
+        self.advanceVariations = []
+        self.model = None
+        self.components = []
+
+
+def varcGlyphRecordKey(glyph, axesMaps, fvarTags):
+    componentNames = sorted(
+        {
+            component.name
+            for layer in glyph.layers.values()
+            for component in layer.glyph.components
+        }
+    )
+    return (
+        tuple(fvarTags),
+        tuple(axesMaps[glyph.name].items()),
+        tuple(tuple(axesMaps.get(name, {}).items()) for name in componentNames),
+    )
+
+
+async def buildVarcGlyphRecord(
+    rcjkfont,
+    glyph,
+    glyphs,
+    fontAxes,
+    axesMaps,
+    publicAxes,
+    fvarTags,
+    iupTolerance=None,
+):
+    record = VarcGlyphRecord()
+
+    glyph_masters = glyphMasters(glyph)
+
+    axes = glyphAxes(glyph, fontAxes)
+    axesMap = axesMaps[glyph.name]
+
+    if (
+        glyph_masters[()].glyph.path.coordinates
+        or not glyph_masters[()].glyph.components
+    ):
+        # Glyph has outline...
+
+        # Only the glyph's own outline; its components are added below
+        record.outline = await buildFlatGlyph(
+            rcjkfont, glyph, axesMap, iupTolerance, shallow=True
+        )
+
+    # VarComposite glyph...
+    if not glyph_masters[()].glyph.components:
+        return record
+
+    componentAnalysis = analyzeComponents(
+        glyph_masters, glyphs, axes, publicAxes, axesMaps, axesMap
+    )
+
+    layer = next(iter(glyph_masters.values()))  # Default master
+    assert len(layer.glyph.components) == len(componentAnalysis), (
+        len(layer.glyph.components),
+        len(componentAnalysis),
+    )
+
+    #
+    # Build variations
+    #
+
+    masterLocs = cachedAxesNormalizer(axes).normalizeLocations(
+        (dictifyLocation(l) for l in glyph_masters.keys()), validate=True
+    )
+    masterLocs = [{axesMap[k]: v for k, v in loc.items()} for loc in masterLocs]
+
+    record.model = VariationModel(masterLocs, list(axes.keys()))
+
+    if record.outline is None:
+        # Without an outline, gvar still has to vary the advance width
+        record.advanceVariations = buildAdvanceVariations(
+            record.model, [layer.glyph.xAdvance for layer in glyph_masters.values()]
+        )
+
+    for ci, (component, ca) in enumerate(
+        zip(layer.glyph.components, componentAnalysis)
+    ):
+        allAxisIndexMasterValues = []
+        allAxisValueMasterValues = []
+        allTransformMasterValues = []
+        for loc, layer in glyph_masters.items():
+            component = layer.glyph.components[ci]
+
+            (
+                axisIndexMasters,
+                axisValueMasters,
+                transformMasters,
+            ) = getComponentMasters(
+                rcjkfont,
+                component,
+                glyphs[component.name],
+                ca,
+                fvarTags,
+                axesMaps[component.name],
+            )
+            allAxisIndexMasterValues.append(axisIndexMasters)
+            allAxisValueMasterValues.append(axisValueMasters)
+            allTransformMasterValues.append(transformMasters)
+
+        allAxisIndexMasterValues = tuple(allAxisIndexMasterValues)
+        allAxisValueMasterValues = tuple(allAxisValueMasterValues)
+        allTransformMasterValues = tuple(allTransformMasterValues)
+
+        axisIndexMasterValues = allAxisIndexMasterValues[0]
+        assert all(
+            axisIndexMasterValues == m for m in allAxisIndexMasterValues
+        ), allAxisIndexMasterValues
+
+        record.components.append(
+            (
+                component.name,
+                ca.getComponentFlags(),
+                axisIndexMasterValues,
+                allAxisValueMasterValues,
+                allTransformMasterValues,
+            )
+        )
+
+    return record
+
+
+def _buildVarcGlyphRecordsChunk(glyphNames):
+    font, fontAxes, axesMaps, publicAxes, fvarTags, iupTolerance = workerState()
+    clearStats()
+
+    async def build():
+        return [
+            await buildVarcGlyphRecord(
+                font,
+                font.glyphs[glyphName],
+                font.glyphs,
+                fontAxes,
+                axesMaps,
+                publicAxes,
+                fvarTags,
+                iupTolerance,
+            )
+            for glyphName in glyphNames
+        ]
+
+    return asyncio.run(build()), collectStats()
+
+
+async def buildVarcGlyphRecordsInPool(
+    rcjkfont,
+    glyphs,
+    glyphNames,
+    fontAxes,
+    axesMaps,
+    publicAxes,
+    fvarTags,
+    iupTolerance=None,
+    jobs=None,
+):
+    """Build the VarcGlyphRecords of glyphNames in a pool of worker
+    processes. Each worker gets its own copy of the glyph table once."""
+    font = await GlyphTableBackend.fromBackend(rcjkfont, glyphs)
+    loop = asyncio.get_running_loop()
+    chunks = poolChunks(glyphNames, jobs)
+
+    records = {}
+    with workerPool(
+        jobs,
+        initargs=(font, fontAxes, axesMaps, publicAxes, fvarTags, iupTolerance),
+    ) as executor:
+        futures = [
+            loop.run_in_executor(executor, _buildVarcGlyphRecordsChunk, chunk)
+            for chunk in chunks
+        ]
+        for chunk, future in zip(chunks, futures):
+            chunkRecords, chunkStats = await future
+            records.update(zip(chunk, chunkRecords))
+            addStats(chunkStats)
+
+    return records
+
+
+async def buildVarcFont(
+    rcjkfont, glyphs, optimizeSpeed=False, cache=None, jobs=1, iupTolerance=None
+):
     print("Building varc.ttf")
+    clearStats()
 
     glyphs = dict(glyphs)
     await closureGlyphs(rcjkfont, glyphs)
+    if optimizeSpeed:
+        # Glyphs are processed in this order as well, which lays out the
+        # MultiVarStore rows of each glyph next to those of its components.
+        glyphs = localityGlyphOrder(glyphs)
 
     publicAxes = dict()
     for axis in (await rcjkfont.getAxes()).axes:
@@ -88,6 +302,15 @@ async def buildVarcFont(rcjkfont, glyphs, optimizeSpeed=False):
     fvarAxes = await setupFvarAxes(rcjkfont, glyphs)
     fvarTags = [axis.tag for axis in fvarAxes]
 
+    fontAxes = AxesNormalizer.fromFontAxes((await rcjkfont.getAxes()).axes).axes
+    axesMaps, regionsBefore, regionsAfter = allocateHiddenAxes(
+        glyphs, fontAxes, publicAxes, fvarTags
+    )
+    print(
+        "Hidden axes regions: %d with sorted allocation, %d with optimized allocation"
+        % (regionsBefore, regionsAfter)
+    )
+
     fb = await createFontBuilder(rcjkfont, "rcjk", "varc", glyphs, glyphDataFormat=1)
     reverseGlyphMap = fb.font.getReverseGlyphMap()
 
@@ -103,115 +326,85 @@ async def buildVarcFont(rcjkfont, glyphs, optimizeSpeed=False):
 
     varStoreBuilder = OnlineMultiVarStoreBuilder(fvarTags)
 
+    keys = {}
+    records = {}
     for glyphName, glyph in glyphs.items():
-        print("Processing varc glyph", glyphName)
-        glyph_masters = glyphMasters(glyph)
-
-        axes = {
-            axis.name: mapTuple(
-                (axis.minValue, axis.defaultValue, axis.maxValue), axis.mapping
+        key = keys[glyphName] = varcGlyphRecordKey(glyph, axesMaps, fvarTags)
+        record = cache.get(glyphName) if cache is not None else None
+        if record is not None and record.key == key:
+            records[glyphName] = record
+
+    # Glyph records are independent of each other, so with jobs the missing
+    # ones are built in worker processes. The MultiVarStore and
+    # AxisIndicesList entries are made from them in glyph order below.
+    todo = [glyphName for glyphName in glyphs if glyphName not in records]
+    if jobs != 1 and len(todo) > 1:
+        print("Processing %d varc glyphs in worker processes" % len(todo))
+        records.update(
+            await buildVarcGlyphRecordsInPool(
+                rcjkfont,
+                glyphs,
+                todo,
+                fontAxes,
+                axesMaps,
+                publicAxes,
+                fvarTags,
+                iupTolerance,
+                jobs,
             )
-            for axis in (await rcjkfont.getAxes()).axes
-        }
-        axes.update(
-            {
-                axis.name: (axis.minValue, axis.defaultValue, axis.maxValue)
-                for axis in glyph.axes
-            }
         )
-        axesNames = set(axes.keys())
-        axesMap = {}
-        i = 0
-        for name in sorted(axes.keys()):
-            if name in publicAxes:
-                axesMap[name] = publicAxes[name]
-            elif name in fvarTags:
-                axesMap[name] = name
-            else:
-                while "%04d" % i in axesNames:
-                    i += 1
-                axesMap[name] = "%04d" % i
-                i += 1
-
-        if (
-            glyph_masters[()].glyph.path.coordinates
-            or not glyph_masters[()].glyph.components
-        ):
-            # Glyph has outline...
-
-            fbGlyphs[glyph.name], fbVariations[glyph.name] = await buildFlatGlyph(
-                rcjkfont, glyph, axesMap
+        for glyphName in todo:
+            records[glyphName].key = keys[glyphName]
+            if cache is not None:
+                cache[glyphName] = records[glyphName]
+
+    for glyphName, glyph in glyphs.items():
+        record = records.get(glyphName)
+        if record is None:
+            print("Processing varc glyph", glyphName)
+            record = await buildVarcGlyphRecord(
+                rcjkfont,
+                glyph,
+                glyphs,
+                fontAxes,
+                axesMaps,
+                publicAxes,
+                fvarTags,
+                iupTolerance,
             )
+            record.key = keys[glyphName]
+            if cache is not None:
+                cache[glyphName] = record
+
+        if record.outline is not None:
+            fbGlyphs[glyphName], fbVariations[glyphName] = record.outline
 
         # VarComposite glyph...
-        if not glyph_masters[()].glyph.components:
+        if not record.components:
             continue
 
-        glyphRecord = varcGlyphs[glyph.name] = ot.VarCompositeGlyph()
+        glyphRecord = varcGlyphs[glyphName] = ot.VarCompositeGlyph()
         componentRecords = glyphRecord.components
 
-        if not glyph_masters[()].glyph.path.coordinates:
-            fbGlyphs[glyph.name] = Glyph()
+        if record.outline is None:
+            fbGlyphs[glyphName] = Glyph()
+            if record.advanceVariations:
+                fbVariations[glyphName] = record.advanceVariations
 
-        componentAnalysis = analyzeComponents(glyph_masters, glyphs, axes, publicAxes)
+        varStoreBuilder.setModel(record.model)
 
-        layer = next(iter(glyph_masters.values()))  # Default master
-        assert len(layer.glyph.components) == len(componentAnalysis), (
-            len(layer.glyph.components),
-            len(componentAnalysis),
-        )
-        for component, ca in zip(layer.glyph.components, componentAnalysis):
+        for (
+            componentName,
+            flags,
+            axisIndexMasterValues,
+            allAxisValueMasterValues,
+            allTransformMasterValues,
+        ) in record.components:
             rec = VarComponent()
-            rec.flags = ca.getComponentFlags()
-            rec.glyphName = component.name
+            rec.flags = flags
+            rec.glyphName = componentName
             componentRecords.append(rec)
 
-        #
-        # Build variations
-        #
-
-        masterLocs = list(dictifyLocation(l) for l in glyph_masters.keys())
-        masterLocs = [normalizeLocation(m, axes, validate=True) for m in masterLocs]
-        masterLocs = [{axesMap[k]: v for k, v in loc.items()} for loc in masterLocs]
-
-        model = VariationModel(masterLocs, list(axes.keys()))
-        varStoreBuilder.setModel(model)
-
-        assert len(componentRecords) == len(componentAnalysis), (
-            len(componentRecords),
-            len(componentAnalysis),
-        )
-        for ci, (rec, ca) in enumerate(zip(componentRecords, componentAnalysis)):
-            allAxisIndexMasterValues = []
-            allAxisValueMasterValues = []
-            allTransformMasterValues = []
-            for loc, layer in glyph_masters.items():
-                component = layer.glyph.components[ci]
-
-                (
-                    axisIndexMasters,
-                    axisValueMasters,
-                    transformMasters,
-                ) = getComponentMasters(
-                    rcjkfont,
-                    component,
-                    glyphs[component.name],
-                    ca,
-                    fvarTags,
-                    publicAxes,
-                )
-                allAxisIndexMasterValues.append(axisIndexMasters)
-                allAxisValueMasterValues.append(axisValueMasters)
-                allTransformMasterValues.append(transformMasters)
-
-            allAxisIndexMasterValues = tuple(allAxisIndexMasterValues)
-            allAxisValueMasterValues = tuple(allAxisValueMasterValues)
-            allTransformMasterValues = tuple(allTransformMasterValues)
-
-            axisIndexMasterValues = allAxisIndexMasterValues[0]
-            assert all(
-                axisIndexMasterValues == m for m in allAxisIndexMasterValues
-            ), allAxisIndexMasterValues
             rec.numAxes = len(axisIndexMasterValues)
             if axisIndexMasterValues:
                 if axisIndexMasterValues in axisIndicesMap:
@@ -235,11 +428,11 @@ async def buildVarcFont(rcjkfont, glyphs, optimizeSpeed=False):
             rec.transform.scaleX = rec.transform.scaleY = 0
             rec.applyTransformDeltas(transformBase)
 
-        if glyph_masters[()].glyph.path.coordinates:
+        if record.outline is not None:
             # Add a component for the outline...
             component = ot.VarComponent()
             component.flags = 0
-            component.glyphName = glyph.name
+            component.glyphName = glyphName
             componentRecords.append(component)
 
     # Reorder axisIndices such that the more used ones come first
@@ -264,21 +457,58 @@ async def buildVarcFont(rcjkfont, glyphs, optimizeSpeed=False):
     print("AxisIndicesList:", len(axisIndicesList))
 
     varStore = varStoreBuilder.finish()
+    numRegions = len(varStore.SparseVarRegionList.Region)
+    numVarData = len(varStore.MultiVarData)
+    numItems = sum(len(varData.Item) for varData in varStore.MultiVarData)
+
+    # Coverage and VarCompositeGlyphs must follow the glyph order
+    varcGlyphNames = sorted(varcGlyphs.keys(), key=reverseGlyphMap.__getitem__)
+
+    # Merge the MultiVarData and lay out their rows in glyph order, then
+    # point the components at the new rows
+    varIdxes = [
+        varIdx
+        for glyphName in varcGlyphNames
+        for component in varcGlyphs[glyphName].components
+        for varIdx in (component.axisValuesVarIndex, component.transformVarIndex)
+    ]
+    varIdxMap = optimizeMultiVarStore(varStore, varIdxes)
+    for glyph in varcGlyphs.values():
+        for component in glyph.components:
+            component.axisValuesVarIndex = varIdxMap[component.axisValuesVarIndex]
+            component.transformVarIndex = varIdxMap[component.transformVarIndex]
+    print(
+        "MultiVarStore: %d regions, %d MultiVarData, %d rows; "
+        "optimized to %d regions, %d MultiVarData, %d rows"
+        % (
+            numRegions,
+            numVarData,
+            numItems,
+            len(varStore.SparseVarRegionList.Region),
+            len(varStore.MultiVarData),
+            sum(len(varData.Item) for varData in varStore.MultiVarData),
+        )
+    )
 
     varCompositeGlyphs = ot.VarCompositeGlyphs()
-    varCompositeGlyphs.VarCompositeGlyph = list(varcGlyphs.values())
+    varCompositeGlyphs.VarCompositeGlyph = [varcGlyphs[g] for g in varcGlyphNames]
 
     varc = newTable("VARC")
     varcTable = varc.table = ot.VARC()
     varcTable.Version = 0x00010000
 
     coverage = varcTable.Coverage = ot.Coverage()
-    coverage.glyphs = list(varcGlyphs.keys())
+    coverage.glyphs = varcGlyphNames
 
     varcTable.MultiVarStore = varStore
     varcTable.AxisIndicesList = axisIndices
     varcTable.VarCompositeGlyphs = varCompositeGlyphs
 
+    printMasterStats()
+    printCu2QuStats()
+    if iupTolerance is not None:
+        printIupStats(fbVariations)
+
     fb.setupFvar(fvarAxes, [])
     fb.setupGlyf(fbGlyphs, validateGlyphFormat=False)
     fb.setupGvar(fbVariations)
@@ -286,5 +516,8 @@ async def buildVarcFont(rcjkfont, glyphs, optimizeSpeed=False):
     fixLsb(fb)
     fb.font["VARC"] = varc
     fb.font.cfg.set("fontTools.ttLib:OPTIMIZE_FONT_SPEED", optimizeSpeed)
+    if jobs != 1:
+        print("Compiling varc.ttf glyphs")
+        precompileGlyfGvar(fb, jobs)
     print("Saving varc.ttf")
     fb.save("varc.ttf")
@@ -0,0 +1,437 @@
+# Check that varc.ttf draws the same outlines as flat.ttf.
+#
+# Usage: python verify.py varc.ttf flat.ttf [--random N] [--tolerance T]
+#
+# Each glyph is drawn from both fonts at its flat masters, halfway to
+# them from the default, and at random locations. Outlines are flattened to
+# polylines and compared point for point where they have the same
+# structure; otherwise by the largest distance of either outline's points
+# to the other outline, so the different curve splitting of the two
+# builds doesn't matter.
+#
+# flat.ttf interpolates decomposed outlines linearly between its masters,
+# while varc.ttf interpolates the component transforms and locations, so
+# away from the masters the two legitimately differ where, say, a scale
+# and a translation vary together. Pick --tolerance accordingly.
+
+from fontTools.ttLib import TTFont
+from fontTools.pens.basePen import BasePen
+from workerPool import poolChunks, workerPool, workerState
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+
+class FlatteningPen(BasePen):
+    """Collect the outline as arrays of polyline points, one per contour,
+    approximating curves by a fixed number of line segments."""
+
+    def __init__(self, glyphSet=None, steps=8):
+        super().__init__(glyphSet)
+        self.steps = steps
+        self.contours = []
+        self._points = None
+
+    def _moveTo(self, pt):
+        self._points = [pt]
+
+    def _lineTo(self, pt):
+        self._points.append(pt)
+
+    def _curveToOne(self, pt1, pt2, pt3):
+        pt0 = self._getCurrentPoint()
+        t = np.linspace(0, 1, self.steps + 1)[1:, None]
+        mt = 1 - t
+        points = (
+            mt**3 * pt0
+            + 3 * mt**2 * t * np.asarray(pt1)
+            + 3 * mt * t**2 * np.asarray(pt2)
+            + t**3 * np.asarray(pt3)
+        )
+        self._points.extend(map(tuple, points))
+
+    def _qCurveToOne(self, pt1, pt2):
+        pt0 = self._getCurrentPoint()
+        t = np.linspace(0, 1, self.steps + 1)[1:, None]
+        mt = 1 - t
+        points = mt**2 * pt0 + 2 * mt * t * np.asarray(pt1) + t**2 * np.asarray(pt2)
+        self._points.extend(map(tuple, points))
+
+    def _closePath(self):
+        if self._points[-1] != self._points[0]:
+            self._points.append(self._points[0])
+        self._endPath()
+
+    def _endPath(self):
+        if self._points:
+            self.contours.append(np.asarray(self._points, dtype=float))
+        self._points = None
+
+
+def flattenGlyph(glyphSet, glyphName):
+    pen = FlatteningPen(glyphSet)
+    glyph = glyphSet[glyphName]
+    glyph.draw(pen)
+    # fontTools gives VARC glyphs their hmtx advance only; without HVAR the
+    # advance varies through the gvar phantom points of the glyf glyph
+    glyfGlyphSet = getattr(glyphSet, "glyphSet", glyphSet)
+    return pen.contours, glyfGlyphSet[glyphName].width
+
+
+def _segments(contours):
+    starts = [c[:-1] for c in contours if len(c) > 1]
+    ends = [c[1:] for c in contours if len(c) > 1]
+    if not starts:
+        return np.empty((0, 2)), np.empty((0, 2))
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def pointsToSegmentsDistance(points, starts, ends):
+    """Largest distance of any of points to its nearest segment."""
+    if not len(points):
+        return 0.0
+    if not len(starts):
+        return np.inf
+    d = ends - starts
+    lengths = (d * d).sum(axis=1)
+    lengths[lengths == 0] = 1
+    result = 0.0
+    # (points × segments) projections, clamped to the segments; in blocks
+    # of points to bound memory use for large glyphs
+    for i in range(0, len(points), 256):
+        rel = points[i : i + 256, None, :] - starts[None, :, :]
+        t = np.clip((rel * d[None, :, :]).sum(axis=2) / lengths, 0, 1)
+        nearest = rel - t[:, :, None] * d[None, :, :]
+        dist = (nearest * nearest).sum(axis=2).min(axis=1)
+        result = max(result, float(dist.max()))
+    return np.sqrt(result)
+
+
+def _subdivideSegments(starts, ends, maxLength):
+    # Cut the segments into pieces of at most maxLength
+    d = ends - starts
+    counts = np.maximum(1, np.ceil(np.hypot(d[:, 0], d[:, 1]) / maxLength))
+    counts = counts.astype(int)
+    segment = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)
+    t0 = (offsets / counts[segment])[:, None]
+    t1 = ((offsets + 1) / counts[segment])[:, None]
+    return starts[segment] + t0 * d[segment], starts[segment] + t1 * d[segment]
+
+
+def gridPointsToSegmentsDistance(points, starts, ends, radius):
+    """Like pointsToSegmentsDistance(), but looking up the segments near
+    each point in a grid, so the cost is about linear in the number of
+    points. Only points with no segment within radius are compared to
+    all segments."""
+    if not len(points) or not len(starts):
+        return pointsToSegmentsDistance(points, starts, ends)
+
+    # Cells of at least twice radius, and about the mean segment length.
+    # Cut into pieces no longer than a cell, every segment within radius
+    # of a point has its midpoint in the point's cell or a neighboring one.
+    d = ends - starts
+    meanLength = np.hypot(d[:, 0], d[:, 1]).mean()
+    cell = max(2 * radius, meanLength, 1e-6)
+    starts, ends = _subdivideSegments(starts, ends, cell)
+
+    origin = np.minimum(points.min(axis=0), starts.min(axis=0)) - cell
+    pieceCells = np.floor(((starts + ends) / 2 - origin) / cell).astype(np.int64)
+    pointCells = np.floor((points - origin) / cell).astype(np.int64)
+    width = max(pieceCells[:, 1].max(), pointCells[:, 1].max()) + 2
+
+    pieceKeys = pieceCells[:, 0] * width + pieceCells[:, 1]
+    order = np.argsort(pieceKeys, kind="stable")
+    pieceKeys = pieceKeys[order]
+    starts, ends = starts[order], ends[order]
+
+    # All (point, nearby piece) pairs
+    pointKeys = pointCells[:, 0] * width + pointCells[:, 1]
+    pairPoints = []
+    pairPieces = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            keys = pointKeys + dx * width + dy
+            lo = np.searchsorted(pieceKeys, keys, side="left")
+            hi = np.searchsorted(pieceKeys, keys, side="right")
+            counts = hi - lo
+            pairPoints.append(np.repeat(np.arange(len(points)), counts))
+            pairPieces.append(
+                np.repeat(lo - (np.cumsum(counts) - counts), counts)
+                + np.arange(counts.sum())
+            )
+    pairPoints = np.concatenate(pairPoints)
+    pairPieces = np.concatenate(pairPieces)
+
+    nearest = np.full(len(points), np.inf)
+    if len(pairPoints):
+        s = starts[pairPieces]
+        d = ends[pairPieces] - s
+        lengths = (d * d).sum(axis=1)
+        lengths[lengths == 0] = 1
+        rel = points[pairPoints] - s
+        t = np.clip((rel * d).sum(axis=1) / lengths, 0, 1)
+        offset = rel - t[:, None] * d
+        np.minimum.at(nearest, pairPoints, (offset * offset).sum(axis=1))
+    nearest = np.sqrt(nearest)
+
+    far = nearest > radius
+    result = float(nearest[~far].max()) if (~far).any() else 0.0
+    if far.any():
+        result = max(result, pointsToSegmentsDistance(points[far], starts, ends))
+    return result
+
+
+def pointwiseDistance(contours1, contours2):
+    """Largest distance between corresponding points, or None if the
+    outlines don't have the same number of contours and points. This is
+    never less than the distance between the outlines."""
+    if len(contours1) != len(contours2) or any(
+        len(c1) != len(c2) for c1, c2 in zip(contours1, contours2)
+    ):
+        return None
+    if not contours1:
+        return 0.0
+    d = np.concatenate(contours1) - np.concatenate(contours2)
+    return float(np.sqrt((d * d).sum(axis=1).max()))
+
+
+def outlineDistance(contours1, contours2, tolerance=0):
+    """The largest distance of either outline's points to the other
+    outline. When the outlines match point for point within tolerance,
+    returns the pointwise distance, which bounds it from above."""
+    distance = pointwiseDistance(contours1, contours2)
+    if distance is not None and distance <= tolerance:
+        return distance
+    points1 = np.concatenate(contours1) if contours1 else np.empty((0, 2))
+    points2 = np.concatenate(contours2) if contours2 else np.empty((0, 2))
+    return max(
+        gridPointsToSegmentsDistance(points1, *_segments(contours2), tolerance),
+        gridPointsToSegmentsDistance(points2, *_segments(contours1), tolerance),
+    )
+
+
+def publicAxes(font):
+    return [axis for axis in font["fvar"].axes if not axis.flags & 0x0001]
+
+
+def glyphMasterLocations(font, glyphName):
+    # The peaks of the flat glyph's variations, in normalized coordinates
+    locations = []
+    for variation in font["gvar"].variations.get(glyphName, []):
+        location = {tag: peak for tag, (start, peak, end) in variation.axes.items()}
+        if location not in locations:
+            locations.append(location)
+    return locations
+
+
+def sampleLocations(font, glyphName, numRandom, rng):
+    masters = glyphMasterLocations(font, glyphName)
+    locations = [{}] + masters
+
+    # Midpoints between the default and each master; pairs of masters are
+    # left to the random locations, to keep this linear in the masters
+    for master in masters:
+        locations.append({tag: value / 2 for tag, value in master.items()})
+
+    axes = publicAxes(font)
+    for i in range(numRandom):
+        locations.append(
+            {
+                axis.axisTag: rng.uniform(
+                    -1 if axis.minValue < axis.defaultValue else 0,
+                    1 if axis.maxValue > axis.defaultValue else 0,
+                )
+                for axis in axes
+            }
+        )
+    return locations
+
+
+def verifyGlyph(varcFont, flatFont, glyphName, numRandom, tolerance, rng):
+    mismatches = []
+    for location in sampleLocations(flatFont, glyphName, numRandom, rng):
+        varcGlyphSet = varcFont.getGlyphSet(location=location, normalized=True)
+        flatGlyphSet = flatFont.getGlyphSet(location=location, normalized=True)
+        varcContours, varcWidth = flattenGlyph(varcGlyphSet, glyphName)
+        flatContours, flatWidth = flattenGlyph(flatGlyphSet, glyphName)
+
+        problems = []
+        if len(varcContours) != len(flatContours):
+            problems.append(
+                "contour count %d != %d" % (len(varcContours), len(flatContours))
+            )
+        if abs(varcWidth - flatWidth) > tolerance:
+            problems.append("advance %g != %g" % (varcWidth, flatWidth))
+        distance = outlineDistance(varcContours, flatContours, tolerance)
+        if distance > tolerance:
+            problems.append("outline distance %.2f" % distance)
+
+        if problems:
+            mismatches.append(
+                {
+                    "glyph": glyphName,
+                    "location": location,
+                    "distance": distance,
+                    "problems": problems,
+                }
+            )
+    return mismatches
+
+
+def _verifyWorkerState(varcPath, flatPath, numRandom, tolerance, seed):
+    return TTFont(varcPath), TTFont(flatPath), numRandom, tolerance, seed
+
+
+def _verifyGlyphsChunk(glyphNames):
+    varcFont, flatFont, numRandom, tolerance, seed = workerState()
+    mismatches = []
+    for glyphName in glyphNames:
+        # Seeded per glyph, so results don't depend on the chunking
+        rng = random.Random("%s:%s" % (seed, glyphName))
+        mismatches.extend(
+            verifyGlyph(varcFont, flatFont, glyphName, numRandom, tolerance, rng)
+        )
+    return len(glyphNames), mismatches
+
+
+def verifyFonts(
+    varcPath, flatPath, glyphNames=None, numRandom=4, tolerance=1, seed=0, jobs=None
+):
+    """Compare the glyphs of varc.ttf and flat.ttf. Returns the list of
+    glyphs that were checked and a list of mismatches."""
+
+    varcFont = TTFont(varcPath)
+    flatFont = TTFont(flatPath)
+    varcGlyphs = set(varcFont.getGlyphOrder())
+    flatGlyphs = set(flatFont.getGlyphOrder())
+
+    if glyphNames is None:
+        glyphNames = flatFont.getGlyphOrder()
+    mismatches = []
+    checked = []
+    for glyphName in glyphNames:
+        if glyphName not in varcGlyphs or glyphName not in flatGlyphs:
+            mismatches.append(
+                {
+                    "glyph": glyphName,
+                    "location": None,
+                    "distance": None,
+                    "problems": ["missing from one of the fonts"],
+                }
+            )
+        else:
+            checked.append(glyphName)
+
+    chunks = poolChunks(checked, jobs, maxSize=256)
+    done = 0
+    with workerPool(
+        jobs, _verifyWorkerState, (varcPath, flatPath, numRandom, tolerance, seed)
+    ) as executor:
+        for count, chunkMismatches in executor.map(_verifyGlyphsChunk, chunks):
+            done += count
+            mismatches.extend(chunkMismatches)
+            print("Verified %d/%d glyphs" % (done, len(checked)), file=sys.stderr)
+
+    return checked, mismatches
+
+
+def printReport(checked, mismatches, file=sys.stdout):
+    glyphs = sorted({m["glyph"] for m in mismatches})
+    print(
+        "Checked %d glyphs; %d mismatches in %d glyphs"
+        % (len(checked), len(mismatches), len(glyphs)),
+        file=file,
+    )
+    for mismatch in sorted(
+        mismatches, key=lambda m: (m["glyph"], -(m["distance"] or 0))
+    ):
+        location = mismatch["location"]
+        if location is not None:
+            location = ",".join(
+                "%s=%.3f" % (tag, value) for tag, value in sorted(location.items())
+            )
+        print(
+            "  %-20s %-30s %s"
+            % (mismatch["glyph"], location or "", "; ".join(mismatch["problems"])),
+            file=file,
+        )
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Check that varc.ttf and flat.ttf draw the same outlines"
+    )
+    parser.add_argument("varc_path", type=str, help="Path to varc.ttf")
+    parser.add_argument("flat_path", type=str, help="Path to flat.ttf")
+    parser.add_argument(
+        "--glyphs",
+        type=int,
+        default=0,
+        help="Number of glyphs to sample, 0 for all (default: 0)",
+    )
+    parser.add_argument(
+        "--random",
+        type=int,
+        default=4,
+        help="Number of random locations per glyph, on top of the masters and "
+        "the midpoints to them (default: 4)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1,
+        help="Largest allowed distance between the outlines, in font units "
+        "(default: 1)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument(
+        "--json",
+        type=str,
+        help="Also write the report as JSON to this path",
+    )
+    args = parser.parse_args(args)
+
+    glyphNames = None
+    if args.glyphs:
+        glyphNames = TTFont(args.flat_path).getGlyphOrder()
+        if args.glyphs < len(glyphNames):
+            rng = random.Random(args.seed)
+            glyphNames = sorted(rng.sample(glyphNames, args.glyphs))
+
+    t0 = time.perf_counter()
+    checked, mismatches = verifyFonts(
+        args.varc_path,
+        args.flat_path,
+        glyphNames,
+        numRandom=args.random,
+        tolerance=args.tolerance,
+        seed=args.seed,
+        jobs=args.jobs,
+    )
+    t1 = time.perf_counter()
+
+    printReport(checked, mismatches)
+    print("Took %.1fs" % (t1 - t0))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"checked": checked, "mismatches": mismatches}, f, indent=2)
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,140 @@
+from memoryBackend import MemoryBackend
+from glyphCache import GlyphCacheBackend
+from flatFont import buildFlatFont
+from varcFont import buildVarcFont
+from rcjkFiles import scanFiles, readGlyphName
+from glyphSelection import EmptySelectionError
+
+from fontra_rcjk.backend_fs import RCJKBackend
+from collections import defaultdict
+import asyncio
+import time
+import traceback
+
+
+def glyphUsers(glyphs):
+    users = defaultdict(set)
+    for glyph in glyphs.values():
+        if glyph is None:
+            continue
+        for layer in glyph.layers.values():
+            for component in layer.glyph.components:
+                users[component.name].add(glyph.name)
+    return users
+
+
+def affectedGlyphs(glyphNames, glyphs):
+    # The glyphs themselves, and everything using them, recursively
+    users = glyphUsers(glyphs)
+    affected = set()
+    stack = list(glyphNames)
+    while stack:
+        glyphName = stack.pop()
+        if glyphName in affected:
+            continue
+        affected.add(glyphName)
+        stack.extend(users.get(glyphName, ()))
+    return affected
+
+
+async def watchFont(
+    rcjk_path,
+    loadGlyphs,
+    optimizeSpeed=False,
+    interval=1.0,
+    jobs=1,
+    iupTolerance=None,
+    glyphCachePath=None,
+):
+    """Build varc.ttf and flat.ttf, then rebuild them whenever files in
+    the font change, only reprocessing the glyphs affected by the change.
+
+    loadGlyphs is called with the backend and returns the glyphs to build.
+    With glyphCachePath, parsed glyphs are kept in that glyph cache file,
+    which is saved after each build. A failing build is reported, and
+    the font is watched for the next change as usual."""
+
+    backend = RCJKBackend.fromPath(rcjk_path)
+    if glyphCachePath:
+        rcjkfont = GlyphCacheBackend(backend, rcjk_path, glyphCachePath)
+    else:
+        rcjkfont = MemoryBackend(backend)
+    varcCache = {}
+    flatCache = {}
+    files = scanFiles(rcjk_path)
+    # Glyphs to reload before the next build, or None to reload everything;
+    # kept until a reload succeeds
+    changedGlyphs = set()
+
+    while True:
+        t0 = time.monotonic()
+        try:
+            if changedGlyphs is None:
+                print("Reloading font")
+                rcjkfont.reload(RCJKBackend.fromPath(rcjk_path))
+                varcCache.clear()
+                flatCache.clear()
+            elif changedGlyphs:
+                affected = affectedGlyphs(changedGlyphs, rcjkfont.glyphs)
+                print(
+                    "Changed glyphs: %s; %d glyphs affected"
+                    % (" ".join(sorted(changedGlyphs)), len(affected))
+                )
+                rcjkfont.reload(RCJKBackend.fromPath(rcjk_path), changedGlyphs)
+                for glyphName in affected:
+                    varcCache.pop(glyphName, None)
+                    flatCache.pop(glyphName, None)
+            changedGlyphs = set()
+
+            glyphs = await loadGlyphs(rcjkfont)
+            await buildVarcFont(
+                rcjkfont,
+                glyphs,
+                optimizeSpeed,
+                cache=varcCache,
+                jobs=jobs,
+                iupTolerance=iupTolerance,
+            )
+            await buildFlatFont(
+                rcjkfont,
+                glyphs,
+                optimizeSpeed,
+                cache=flatCache,
+                jobs=jobs,
+                iupTolerance=iupTolerance,
+            )
+            if glyphCachePath:
+                rcjkfont.save()
+        except EmptySelectionError as e:
+            print("%s; watching %s for changes" % (e, rcjk_path))
+        except Exception:
+            traceback.print_exc()
+            print("Build failed; watching %s for changes" % rcjk_path)
+        else:
+            t1 = time.monotonic()
+            print("Built in %.1fs; watching %s for changes" % (t1 - t0, rcjk_path))
+
+        while True:
+            await asyncio.sleep(interval)
+            newFiles = scanFiles(rcjk_path)
+            if newFiles != files:
+                break
+
+        changed = [
+            path
+            for path in set(files) | set(newFiles)
+            if files.get(path) != newFiles.get(path)
+        ]
+        files = newFiles
+
+        for path in changed:
+            if changedGlyphs is None:
+                break
+            # Anything but a modified or added glyph file needs a full reload
+            glyphName = None
+            if path.endswith(".glif") and path in newFiles:
+                glyphName = readGlyphName(path)
+            if glyphName is None:
+                changedGlyphs = None
+                break
+            changedGlyphs.add(glyphName)
@@ -0,0 +1,35 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+
+def poolChunks(items, jobs=None, maxSize=64):
+    """Split items into chunks for a pool of jobs worker processes: about
+    four per worker, so that they stay busy, of at most maxSize items."""
+    if jobs is None:
+        jobs = os.cpu_count()
+    items = list(items)
+    size = max(1, -(-len(items) // (jobs * 4)))
+    if maxSize is not None:
+        size = min(size, maxSize)
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+_workerState = None
+
+
+def _initWorker(initializer, initargs):
+    global _workerState
+    _workerState = initializer(*initargs) if initializer is not None else initargs
+
+
+def workerPool(jobs=None, initializer=None, initargs=()):
+    """A ProcessPoolExecutor of jobs worker processes. Each worker sets up
+    its state once: the result of initializer(*initargs), or initargs
+    itself without initializer. Chunk functions get it from workerState()."""
+    return ProcessPoolExecutor(
+        jobs, initializer=_initWorker, initargs=(initializer, initargs)
+    )
+
+
+def workerState():
+    return _workerState